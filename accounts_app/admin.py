@@ -1,6 +1,6 @@
 from django.contrib import admin
 from .api.forms import CustomUserCreationForm, CustomUserChangeForm
-from .models import CustomUser
+from .models import AuthToken, CustomUser
 from django.contrib.auth.admin import UserAdmin
 
 @admin.register(CustomUser)
@@ -13,4 +13,8 @@ class CustomUserAdmin(UserAdmin):
         *UserAdmin.fieldsets, 
     )
     list_display = ('username', 'email', 'first_name', 'last_name', 'is_staff')
-    
\ No newline at end of file
+
+@admin.register(AuthToken)
+class AuthTokenAdmin(admin.ModelAdmin):
+    list_display = ('user', 'created', 'expires_at', 'last_used_at')
+    raw_id_fields = ('user',)
@@ -0,0 +1,74 @@
+import hashlib
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from accounts_app.models import AuthToken
+
+
+def get_token_cache_key(key):
+    # Only a hash of the token ends up in Redis key names
+    return f"auth:token:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+def invalidate_token(key):
+    cache.delete(get_token_cache_key(key))
+
+
+def invalidate_user_tokens(user):
+    """
+    Drop the cached lookups of all tokens of a user, e.g. after a password change.
+    """
+    keys = AuthToken.objects.filter(user=user).values_list("key", flat=True)
+    cache.delete_many([get_token_cache_key(key) for key in keys])
+
+
+def rotate_token(token):
+    """
+    Replace a token by a new one with a fresh expiry, the old key stops working.
+    """
+    new_token = AuthToken.objects.create(user=token.user)
+    token.delete()
+    return new_token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication for the expiring AuthToken that keeps token => user in the
+    cache for TOKEN_CACHE_TIMEOUT seconds, so authenticated requests don't query the
+    token and user tables. The entries are dropped by the signals in accounts_app.api.signals.
+    """
+    model = AuthToken
+
+    def authenticate_credentials(self, key):
+        cache_key = get_token_cache_key(key)
+        cached = cache.get(cache_key)
+        if cached is None:
+            cached = super().authenticate_credentials(key)
+            cache.set(cache_key, cached, getattr(settings, "TOKEN_CACHE_TIMEOUT", 60))
+        user, token = cached
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_("User inactive or deleted."))
+        if token.is_expired:
+            invalidate_token(key)
+            raise exceptions.AuthenticationFailed(_("Token has expired."))
+        if self.touch_token(token):
+            cache.set(cache_key, cached, getattr(settings, "TOKEN_CACHE_TIMEOUT", 60))
+        return user, token
+
+    def touch_token(self, token):
+        """
+        Update last_used_at if it's older than TOKEN_LAST_USED_INTERVAL seconds,
+        so a busy client doesn't write the token row on every request.
+        Returns True if the row was updated.
+        """
+        now = timezone.now()
+        threshold = now - timedelta(seconds=getattr(settings, "TOKEN_LAST_USED_INTERVAL", 300))
+        if token.last_used_at > threshold:
+            return False
+        AuthToken.objects.filter(pk=token.pk).update(last_used_at=now)
+        token.last_used_at = now
+        return True
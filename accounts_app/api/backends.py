@@ -1,16 +1,36 @@
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth import get_user_model
+from django.db.models import Q, Value
+from django.db.models.functions import Upper
+from django.db.models.lookups import Exact
 
-class EmailBackend(ModelBackend):
+class UsernameOrEmailBackend(ModelBackend):
     """
-    Custom Authentication Backend, um Login per E-Mail und Passwort zu erlauben.
-    Muss in den Django-Einstellungen unter AUTHENTICATION_BACKENDS eingetragen werden!
+    Login per Benutzername oder E-Mail und Passwort, mit einer Query über die
+    case-insensitiven Indizes auf username und email (siehe CustomUser.Meta).
+    Ersetzt ModelBackend in AUTHENTICATION_BACKENDS.
     """
     def authenticate(self, request, username=None, password=None, **kwargs):
         UserModel = get_user_model()
-        try:
-            user = UserModel.objects.get(email=username)
-            if user.check_password(password):
-                return user
-        except UserModel.DoesNotExist:
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
             return None
+        # UPPER(spalte) = UPPER(wert) statt __iexact (LIKE auf SQLite), damit der Index passt
+        login = Upper(Value(username))
+        # Ohne Limit: bei bob/BOB/Bob darf der exakte Treffer nicht abgeschnitten werden,
+        # email ist case-insensitiv eindeutig, es sind also nur die Schreibweisen eines Namens
+        users = list(
+            UserModel._default_manager.filter(Q(Exact(Upper('username'), login)) | Q(Exact(Upper('email'), login)))
+        )
+        if len(users) > 1:
+            # Only differ in case or one's username is the other's email, the exact match wins
+            users = [u for u in users if username in (u.username, u.email)]
+        if len(users) != 1:
+            # Hash anyway, so the response time doesn't tell whether the user exists
+            UserModel().set_password(password)
+            return None
+        user = users[0]
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -13,7 +13,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         extra_kwargs = {"password": {"write_only": True}}
 
     def validate_email(self, value):
-        if CustomUser.objects.filter(email=value).exists():
+        if CustomUser.objects.filter_by_email(value).exists():
             raise serializers.ValidationError("Please check your entries and try again.")
         return value
 
@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from accounts_app.models import AuthToken, CustomUser
+from .authentication import invalidate_token, invalidate_user_tokens
+
+
+@receiver(post_save, sender=CustomUser)
+def user_invalidate_tokens(sender, instance, created, **kwargs):
+    # Soft delete, restore, password reset etc. all save the user
+    if not created:
+        invalidate_user_tokens(instance)
+
+
+@receiver(post_delete, sender=AuthToken)
+def token_invalidate_cache(sender, instance, **kwargs):
+    # Logout, rotation, purge and hard delete (the tokens are deleted with the user)
+    invalidate_token(instance.key)
@@ -0,0 +1,121 @@
+import json
+import logging
+import django_rq
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+from rq import Retry
+from accounts_app.models import AuthToken
+from core.queues import get_queue, get_queue_name
+
+logger = logging.getLogger(__name__)
+
+MAIL_OUTBOX_KEY = "mail:outbox"
+MAIL_FLUSH_SCHEDULED_KEY = "mail:flush_scheduled"
+MAIL_FLUSH_SCHEDULED_TIMEOUT = 300
+
+
+def get_mail_connection():
+    return django_rq.get_connection(get_queue_name("mail"))
+
+
+def queue_mail(subject, message, recipient_list, from_email=None):
+    """
+    Put a mail into the Redis outbox and make sure a flush job is queued.
+    The request doesn't wait for the mail server, if Redis is down the mail is sent right away.
+    """
+    payload = json.dumps({
+        "subject": subject,
+        "body": message,
+        "from_email": from_email or settings.DEFAULT_FROM_EMAIL,
+        "to": list(recipient_list),
+    })
+    try:
+        connection = get_mail_connection()
+        connection.rpush(MAIL_OUTBOX_KEY, payload)
+    except Exception as e:
+        logger.warning(f"Failed to queue mail to {recipient_list}, sending it now: {e}")
+        get_connection().send_messages([build_email_message(payload)])
+        return
+    schedule_mail_flush(connection)
+
+
+def schedule_mail_flush(connection):
+    """
+    Enqueue a flush job unless one is pending. The mail is in the outbox already,
+    so a failure here must not send it directly, it is sent with the next flush.
+    """
+    scheduled = False
+    try:
+        # Mails queued until the job runs are sent in the same batch
+        scheduled = connection.set(MAIL_FLUSH_SCHEDULED_KEY, 1, nx=True, ex=MAIL_FLUSH_SCHEDULED_TIMEOUT)
+        if scheduled:
+            enqueue_mail_flush()
+    except Exception as e:
+        logger.warning(f"Failed to schedule a mail flush: {e}")
+        if scheduled:
+            # Without a job the flag would block scheduling until it expires
+            try:
+                connection.delete(MAIL_FLUSH_SCHEDULED_KEY)
+            except Exception as e:
+                logger.warning(f"Failed to reset the mail flush flag: {e}")
+
+
+def enqueue_mail_flush():
+    intervals = getattr(settings, "MAIL_RETRY_INTERVALS", [])
+    get_queue("mail").enqueue(
+        flush_mail_outbox,
+        retry=Retry(max=len(intervals), interval=intervals) if intervals else None,
+    )
+
+
+def build_email_message(payload):
+    data = json.loads(payload)
+    return EmailMessage(data["subject"], data["body"], data["from_email"], data["to"])
+
+
+def flush_mail_outbox(batch_size=None):
+    """
+    Send the queued mails in batches over one mail server connection.
+    A failed batch goes back into the outbox and the job is retried with backoff.
+    Returns the number of sent mails.
+    """
+    batch_size = batch_size or getattr(settings, "MAIL_BATCH_SIZE", 100)
+    connection = get_mail_connection()
+    connection.delete(MAIL_FLUSH_SCHEDULED_KEY)
+    sent = 0
+    with get_connection() as mail_connection:
+        while True:
+            pipeline = connection.pipeline()
+            pipeline.lrange(MAIL_OUTBOX_KEY, 0, batch_size - 1)
+            pipeline.ltrim(MAIL_OUTBOX_KEY, batch_size, -1)
+            payloads, _ = pipeline.execute()
+            if not payloads:
+                break
+            try:
+                sent += mail_connection.send_messages([build_email_message(p) for p in payloads]) or 0
+            except Exception as e:
+                logger.error(f"Failed to send {len(payloads)} mails: {e}")
+                connection.lpush(MAIL_OUTBOX_KEY, *reversed(payloads))
+                raise
+    logger.info(f"Sent {sent} mails")
+    return sent
+
+
+def purge_expired_tokens(batch_size=None):
+    """
+    Delete expired tokens in batches, so the delete doesn't lock the token table
+    for long. Run periodically, see the purge_expired_tokens command.
+    Returns the number of deleted tokens.
+    """
+    batch_size = batch_size or getattr(settings, "TOKEN_PURGE_BATCH_SIZE", 1000)
+    now = timezone.now()
+    deleted = 0
+    while True:
+        keys = list(AuthToken.objects.filter(expires_at__lte=now).values_list("key", flat=True)[:batch_size])
+        if not keys:
+            break
+        count, _ = AuthToken.objects.filter(key__in=keys).delete()
+        deleted += count
+    logger.info(f"Purged {deleted} expired tokens")
+    return deleted
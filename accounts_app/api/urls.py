@@ -3,6 +3,8 @@ from .views import (
     HardDeleteAccountView,
     RegisterUserView,
     LoginUserView,
+    LogoutUserView,
+    RefreshTokenView,
     ActivateAccountView,
     RequestNewActivationLinkView,
     PasswordResetRequestView,
@@ -15,6 +17,8 @@ urlpatterns = [
 #------------------------------------------authentication---------------------------------------------------#
     path('register/', RegisterUserView.as_view(), name='register-user'),
     path('login/', LoginUserView.as_view(), name='login-user'),
+    path('logout/', LogoutUserView.as_view(), name='logout-user'),
+    path('token/refresh/', RefreshTokenView.as_view(), name='refresh-token'),
     path('activate/<str:activation_code>/', ActivateAccountView.as_view(), name='activate_account'),
     path('request-new-activation-link/', RequestNewActivationLinkView.as_view(), name='request_new_activation_link'),
     path('delete-account/', SoftDeleteAccountView.as_view(), name='soft-delete-account'),
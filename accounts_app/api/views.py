@@ -1,11 +1,11 @@
 from rest_framework import views, status
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
-from rest_framework.authtoken.models import Token
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.conf import settings
-from accounts_app.models import CustomUser
+from accounts_app.models import AuthToken, CustomUser
+from .authentication import rotate_token
 from .serializers import (
     UserRegistrationSerializer, LoginSerializer, PasswordResetRequestSerializer, PasswordResetSerializer
 )
@@ -51,17 +51,36 @@ class LoginUserView(views.APIView):
         serializer = LoginSerializer(data=request.data, context={'request': request})
         if serializer.is_valid():
             user = serializer.validated_data['user']
-            token, created = Token.objects.get_or_create(user=user)
-            return Response({"token": token.key, "user_id": user.pk, "email": user.email}, status=status.HTTP_200_OK)
+            token = AuthToken.objects.create(user=user)
+            return Response(
+                {"token": token.key, "expires_at": token.expires_at, "user_id": user.pk, "email": user.email},
+                status=status.HTTP_200_OK
+            )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class LogoutUserView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        # Deleting the token also drops it from the auth cache (signals)
+        AuthToken.objects.filter(key=request.auth.key).delete()
+        return Response({"detail": "Logged out."}, status=status.HTTP_200_OK)
+
+class RefreshTokenView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        # The old token is deleted, a leaked token can't be refreshed forever next to the new one
+        token = rotate_token(request.auth)
+        return Response({"token": token.key, "expires_at": token.expires_at}, status=status.HTTP_200_OK)
+
 class RequestNewActivationLinkView(views.APIView):
     permission_classes = [AllowAny]
 
     def post(self, request):
         email = request.data.get('email')
         try:
-            user = CustomUser.objects.get(email=email, is_active=False)
+            user = CustomUser.objects.filter_by_email(email).get(is_active=False)
             if not user.activation_code_expiry or timezone.now() > user.activation_code_expiry:
                 user.activation_code, user.activation_code_expiry = generate_activation_code()
                 user.save()
@@ -81,7 +100,7 @@ class PasswordResetRequestView(views.APIView):
         if serializer.is_valid():
             email = serializer.validated_data['email']
             try:
-                user = CustomUser.objects.get(email=email, is_active=True)
+                user = CustomUser.objects.filter_by_email(email).get(is_active=True)
                 user.activation_code, user.activation_code_expiry = generate_activation_code()
                 user.save()
                 send_password_reset_email(user, request)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from accounts_app.api.tasks import purge_expired_tokens
+from core.queues import get_queue
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired auth tokens. Meant to run periodically, "
+        "e.g. hourly from cron: python manage.py purge_expired_tokens --enqueue"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--enqueue", action="store_true", help="Run the purge as a job on the RQ queue.")
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options["enqueue"]:
+            job = get_queue("maintenance").enqueue(purge_expired_tokens, options["batch_size"])
+            self.stdout.write(f"Enqueued token purge job {job.id}")
+            return
+        deleted = purge_expired_tokens(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired tokens"))
@@ -0,0 +1,73 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:38
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models.functions import Upper
+
+
+def check_case_variant_emails(apps, schema_editor):
+    """
+    unique_user_email_upper fails on emails that only differ in case, e.g.
+    Bob@example.com and bob@example.com. Accounts can't be merged here, so the
+    migration stops with the affected emails and they have to be resolved by hand.
+    """
+    CustomUser = apps.get_model('accounts_app', 'CustomUser')
+    duplicates = (
+        CustomUser.objects.annotate(email_upper=Upper('email'))
+        .values('email_upper')
+        .annotate(count=models.Count('id'))
+        .filter(count__gt=1)
+        .values_list('email_upper', flat=True)
+    )
+    emails = sorted(
+        CustomUser.objects.annotate(email_upper=Upper('email'))
+        .filter(email_upper__in=list(duplicates))
+        .values_list('email', flat=True)
+    )
+    if emails:
+        raise RuntimeError(
+            "Emails used by more than one account (ignoring case): "
+            f"{', '.join(emails)}. Change or delete the duplicate accounts and migrate again."
+        )
+
+
+def clear_duplicate_activation_codes(apps, schema_editor):
+    """
+    A code used by several accounts is cleared, those users request a new one.
+    """
+    CustomUser = apps.get_model('accounts_app', 'CustomUser')
+    duplicates = (
+        CustomUser.objects.filter(activation_code__isnull=False)
+        .values('activation_code')
+        .annotate(count=models.Count('id'))
+        .filter(count__gt=1)
+        .values_list('activation_code', flat=True)
+    )
+    CustomUser.objects.filter(activation_code__in=list(duplicates)).update(
+        activation_code=None, activation_code_expiry=None
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts_app', '0005_customuser_login_indexes'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_case_variant_emails, migrations.RunPython.noop),
+        migrations.RunPython(clear_duplicate_activation_codes, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='customuser',
+            name='user_email_upper_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Upper('email'), name='unique_user_email_upper'),
+        ),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(condition=models.Q(('activation_code__isnull', False)), fields=('activation_code',), name='unique_activation_code'),
+        ),
+    ]
@@ -1,5 +1,11 @@
+import binascii
+import os
 from django.contrib.auth.base_user import BaseUserManager
+from django.conf import settings
 from django.db import models
+from django.db.models import Q, Value
+from django.db.models.functions import Upper
+from django.db.models.lookups import Exact
 from django.contrib.auth.models import AbstractUser
 import uuid
 from django.utils import timezone
@@ -33,6 +39,12 @@ class CustomUserManager(BaseUserManager):
 
         return self.create_user(username, email, password, **extra_fields)
 
+    def filter_by_email(self, email):
+        """
+        Case-insensitive email lookup, UPPER(email) = UPPER(...) uses the unique_user_email_upper index.
+        """
+        return self.filter(Exact(Upper('email'), Upper(Value(email))))
+
 
 class CustomUser(AbstractUser):
     custom = models.CharField(max_length=500, blank=True, null=True)
@@ -43,6 +55,19 @@ class CustomUser(AbstractUser):
     is_soft_deleted = models.BooleanField(default=False)
     objects = CustomUserManager()
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Case-insensitive login lookups, see UsernameOrEmailBackend
+            models.Index(Upper('username'), name='user_username_upper_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(Upper('email'), name='unique_user_email_upper'),
+            # Only pending activations and resets have a code
+            models.UniqueConstraint(
+                fields=['activation_code'], condition=Q(activation_code__isnull=False), name='unique_activation_code'
+            ),
+        ]
+
     def generate_activation_code(self):
         self.activation_code = str(uuid.uuid4())
         self.activation_code_expiry = timezone.now() + timedelta(
@@ -51,3 +76,36 @@ class CustomUser(AbstractUser):
 
     def __str__(self):
         return self.username
+
+
+def get_token_expiry():
+    return timezone.now() + timedelta(seconds=getattr(settings, "TOKEN_LIFETIME", 60 * 60 * 24 * 7))
+
+
+class AuthToken(models.Model):
+    """
+    An expiring API token, a user gets one per login. Expired tokens are
+    deleted by the purge_expired_tokens job, so the table stays small.
+    """
+    key = models.CharField(max_length=40, primary_key=True)
+    user = models.ForeignKey(CustomUser, related_name='auth_tokens', on_delete=models.CASCADE)
+    created = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(default=get_token_expiry, db_index=True)
+    # Written at most every TOKEN_LAST_USED_INTERVAL seconds, not on every request
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    def save(self, *args, **kwargs):
+        if not self.key:
+            self.key = self.generate_key()
+        return super().save(*args, **kwargs)
+
+    @classmethod
+    def generate_key(cls):
+        return binascii.hexlify(os.urandom(20)).decode()
+
+    @property
+    def is_expired(self):
+        return timezone.now() >= self.expires_at
+
+    def __str__(self):
+        return f"{self.user} ({self.expires_at:%Y-%m-%d %H:%M})"
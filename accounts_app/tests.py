@@ -1,9 +1,18 @@
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
-from accounts_app.models import CustomUser
-from rest_framework.authtoken.models import Token
+from accounts_app.models import AuthToken, CustomUser
+from datetime import timedelta
 from django.utils import timezone
+from django.contrib.auth import authenticate
+from django.core import mail
+from django.core.mail import get_connection
+from unittest.mock import MagicMock, patch
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from accounts_app.api.tasks import (
+    MAIL_FLUSH_SCHEDULED_KEY, MAIL_OUTBOX_KEY, flush_mail_outbox, get_mail_connection, purge_expired_tokens, queue_mail
+)
 
 class AccountsIntegrationTests(APITestCase):
     def setUp(self):
@@ -11,13 +20,13 @@ class AccountsIntegrationTests(APITestCase):
         self.admin = CustomUser.objects.create_user(
             username="admin", email="admin@test.de", password="Admin123!", is_staff=True, is_active=True
         )
-        self.admin_token = Token.objects.create(user=self.admin)
+        self.admin_token = AuthToken.objects.create(user=self.admin)
 
         # Create regular user (activated)
         self.user = CustomUser.objects.create_user(
             username="testuser", email="user@test.de", password="User123!", is_active=True
         )
-        self.user_token = Token.objects.create(user=self.user)
+        self.user_token = AuthToken.objects.create(user=self.user)
 
         # Create inactive user (not activated yet)
         self.inactive_user = CustomUser.objects.create_user(
@@ -279,4 +288,200 @@ class AccountsIntegrationTests(APITestCase):
         url = f"/api/admin/restore-account/99999/"
         self.client.credentials(HTTP_AUTHORIZATION="Token " + self.admin_token.key)
         response = self.client.post(url)
-        self.assertEqual(response.status_code, 404)
\ No newline at end of file
+        self.assertEqual(response.status_code, 404)
+    # --- MAIL QUEUE ---
+    @patch("accounts_app.api.tasks.get_queue")
+    def test_registration_queues_mail_instead_of_sending(self, mock_get_queue):
+        get_mail_connection().delete(MAIL_OUTBOX_KEY, MAIL_FLUSH_SCHEDULED_KEY)
+        for index in range(3):
+            response = self.client.post("/api/register/", {
+                "email": f"queued{index}@example.com",
+                "username": f"queued{index}",
+                "password": "Queued123!",
+                "password_confirm": "Queued123!",
+            })
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        # One flush job for all mails queued before it runs
+        self.assertEqual(mock_get_queue.return_value.enqueue.call_count, 1)
+
+        with patch("accounts_app.api.tasks.get_connection", wraps=get_connection) as mock_connection:
+            self.assertEqual(flush_mail_outbox(batch_size=2), 3)
+        self.assertEqual(mock_connection.call_count, 1)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), [f"queued{i}@example.com" for i in range(3)])
+        self.assertEqual(get_mail_connection().llen(MAIL_OUTBOX_KEY), 0)
+
+    @patch("accounts_app.api.tasks.get_queue")
+    def test_failed_mail_batch_stays_in_outbox(self, mock_get_queue):
+        get_mail_connection().delete(MAIL_OUTBOX_KEY, MAIL_FLUSH_SCHEDULED_KEY)
+        queue_mail("Subject", "Body", ["retry@example.com"])
+        with patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=OSError("SMTP down")):
+            with self.assertRaises(OSError):
+                flush_mail_outbox()
+        self.assertEqual(get_mail_connection().llen(MAIL_OUTBOX_KEY), 1)
+        self.assertEqual(flush_mail_outbox(), 1)
+        self.assertEqual(mail.outbox[0].to, ["retry@example.com"])
+
+    @patch("accounts_app.api.tasks.get_queue")
+    def test_queue_mail_scheduling_failures_dont_send_twice(self, mock_get_queue):
+        real_connection = get_mail_connection()
+        real_connection.delete(MAIL_OUTBOX_KEY, MAIL_FLUSH_SCHEDULED_KEY)
+        connection = MagicMock(wraps=real_connection)
+        with patch("accounts_app.api.tasks.get_mail_connection", return_value=connection):
+            # Setting the flag fails: the mail stays in the outbox, nothing is sent now
+            connection.set.side_effect = ConnectionError("Redis gone")
+            queue_mail("Subject", "Body", ["first@example.com"])
+            self.assertEqual(len(mail.outbox), 0)
+            mock_get_queue.return_value.enqueue.assert_not_called()
+
+            # Enqueueing fails: the flag is reset, so the next mail schedules the flush again
+            connection.set.side_effect = None
+            mock_get_queue.return_value.enqueue.side_effect = ConnectionError("Redis gone")
+            queue_mail("Subject", "Body", ["second@example.com"])
+            self.assertEqual(len(mail.outbox), 0)
+            self.assertFalse(real_connection.exists(MAIL_FLUSH_SCHEDULED_KEY))
+
+            mock_get_queue.return_value.enqueue.side_effect = None
+            queue_mail("Subject", "Body", ["third@example.com"])
+            self.assertEqual(mock_get_queue.return_value.enqueue.call_count, 2)
+        self.assertEqual(flush_mail_outbox(), 3)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_queue_mail_sends_directly_if_outbox_is_unavailable(self):
+        with patch("accounts_app.api.tasks.get_mail_connection") as mock_connection:
+            mock_connection.return_value.rpush.side_effect = ConnectionError("Redis gone")
+            queue_mail("Subject", "Body", ["direct@example.com"])
+        self.assertEqual([m.to for m in mail.outbox], [["direct@example.com"]])
+        mock_connection.return_value.set.assert_not_called()
+
+    # --- TOKEN CACHE ---
+    def test_token_lookup_is_cached(self):
+        url = "/api/delete-account/"
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.user_token.key)
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.client.delete(url, {}).status_code, 400)
+        with CaptureQueriesContext(connection) as second:
+            self.assertEqual(self.client.delete(url, {}).status_code, 400)
+        self.assertEqual(len(first), 1)
+        self.assertEqual(len(second), 0)
+
+    def test_logout_and_soft_delete_invalidate_cached_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.user_token.key)
+        self.assertEqual(self.client.delete("/api/delete-account/", {}).status_code, 400)
+        self.assertEqual(self.client.post("/api/logout/").status_code, 200)
+        self.assertEqual(self.client.delete("/api/delete-account/", {}).status_code, 401)
+
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.admin_token.key)
+        self.assertEqual(self.client.delete("/api/delete-account/", {}).status_code, 400)
+        self.assertEqual(self.client.delete("/api/delete-account/", {"confirm": True}).status_code, 204)
+        self.assertEqual(self.client.delete("/api/delete-account/", {}).status_code, 401)
+
+    # --- TOKEN EXPIRY ---
+    def test_expired_token_is_rejected_and_purged(self):
+        AuthToken.objects.filter(pk=self.user_token.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.user_token.key)
+        self.assertEqual(self.client.delete("/api/delete-account/", {}).status_code, 401)
+
+        self.assertEqual(purge_expired_tokens(batch_size=1), 1)
+        self.assertFalse(AuthToken.objects.filter(pk=self.user_token.pk).exists())
+        self.assertTrue(AuthToken.objects.filter(pk=self.admin_token.pk).exists())
+
+    def test_last_used_at_is_written_lazily(self):
+        stale = timezone.now() - timedelta(hours=1)
+        AuthToken.objects.filter(pk=self.user_token.pk).update(last_used_at=stale)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.user_token.key)
+        with CaptureQueriesContext(connection) as first:
+            self.client.delete("/api/delete-account/", {})
+        with CaptureQueriesContext(connection) as second:
+            self.client.delete("/api/delete-account/", {})
+        self.assertEqual([q["sql"].split()[0] for q in first], ["SELECT", "UPDATE"])
+        self.assertEqual(len(second), 0)
+        self.user_token.refresh_from_db()
+        self.assertGreater(self.user_token.last_used_at, stale)
+
+    def test_login_creates_token_and_refresh_rotates_it(self):
+        response = self.client.post("/api/login/", {"email": "user@test.de", "password": "User123!"})
+        old_key = response.data["token"]
+        self.assertIn("expires_at", response.data)
+
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + old_key)
+        response = self.client.post("/api/token/refresh/")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data["token"], old_key)
+        self.assertEqual(self.client.delete("/api/delete-account/", {}).status_code, 401)
+
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + response.data["token"])
+        self.assertEqual(self.client.delete("/api/delete-account/", {}).status_code, 400)
+
+    # --- LOGIN BACKEND ---
+    def test_login_backend_uses_one_query_for_username_or_email(self):
+        for login in ["User@Test.de", "TESTUSER"]:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(authenticate(username=login, password="User123!"), self.user)
+            self.assertEqual(len(queries), 1)
+        # Login endpoint: user lookup and token insert, the rest is the password hash
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post("/api/login/", {"email": "user@test.de", "password": "User123!"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(queries), 2)
+
+    def test_login_backend_picks_exact_match_among_case_variants(self):
+        users = {}
+        for index, username in enumerate(["bob", "BOB", "Bob"]):
+            users[username] = CustomUser.objects.create_user(
+                username=username, email=f"bob{index}@test.de", password=f"{username}123!", is_active=True
+            )
+        for username, user in users.items():
+            self.assertEqual(authenticate(username=username, password=f"{username}123!"), user)
+        # No exact match, ambiguous
+        self.assertIsNone(authenticate(username="bOb", password="Bob123!"))
+
+    @patch.object(CustomUser, "set_password")
+    def test_login_backend_hashes_for_unknown_user(self, mock_set_password):
+        self.assertIsNone(authenticate(username="nobody@test.de", password="Secret123!"))
+        mock_set_password.assert_called_once_with("Secret123!")
+
+    # --- LOOKUP INDEXES ---
+    def _user_lookup_plans(self, queries):
+        """
+        EXPLAIN the captured SELECTs on the user table.
+        """
+        explain = "EXPLAIN QUERY PLAN " if connection.vendor == "sqlite" else "EXPLAIN "
+        plans = []
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # A few rows make Postgres prefer a Seq Scan, the test only asks if the index fits the query
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            for query in queries:
+                if query["sql"].startswith("SELECT") and 'FROM "accounts_app_customuser"' in query["sql"]:
+                    cursor.execute(explain + query["sql"])
+                    plans.append(" ".join(str(column) for row in cursor.fetchall() for column in row))
+        return plans
+
+    def test_lookup_indexes_exist(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, CustomUser._meta.db_table)
+        self.assertTrue(constraints["unique_activation_code"]["unique"])
+        self.assertTrue(constraints["unique_user_email_upper"]["unique"])
+        self.assertTrue(constraints["user_username_upper_idx"]["index"])
+
+    def test_activation_code_lookups_use_partial_index(self):
+        for url, method in [("/api/activate/somecode/", self.client.get),
+                            ("/api/password-reset-confirm/somecode/", self.client.post)]:
+            with CaptureQueriesContext(connection) as queries:
+                method(url)
+            plans = self._user_lookup_plans(queries)
+            self.assertEqual(len(plans), 1)
+            self.assertIn("unique_activation_code", plans[0])
+
+    def test_email_lookups_use_index_and_ignore_case(self):
+        for url, email in [("/api/request-new-activation-link/", "Inactive@Test.de"),
+                           ("/api/password-reset/", "USER@test.de")]:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.post(url, {"email": email}).status_code, 200)
+            plans = self._user_lookup_plans(queries)
+            self.assertIn("unique_user_email_upper", plans[0])
+        self.inactive_user.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.inactive_user.activation_code)
+        self.assertIsNotNone(self.user.activation_code)
@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
+
+The conversion progress stream (Server-Sent Events) keeps connections open,
+serve it through this application with an ASGI server, e.g. uvicorn core.asgi:application.
 """
 
 import os
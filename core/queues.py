@@ -0,0 +1,17 @@
+import django_rq
+from django.conf import settings
+
+
+def get_queue_name(job_type):
+    """
+    Name of the RQ queue a job type is routed to, see RQ_QUEUE_ROUTES.
+    Unknown job types go to the default queue.
+    """
+    return getattr(settings, "RQ_QUEUE_ROUTES", {}).get(job_type, "default")
+
+
+def get_queue(job_type):
+    """
+    The queue for a job type, e.g. get_queue("thumbnail").enqueue(create_thumbnail, video_id).
+    """
+    return django_rq.get_queue(get_queue_name(job_type), autocommit=True)
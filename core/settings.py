@@ -52,7 +52,6 @@ INSTALLED_APPS = [
     "django_rq",
     "corsheaders",
     "rest_framework",
-    "rest_framework.authtoken",
     "debug_toolbar",
     "import_export",
     "accounts_app",
@@ -75,13 +74,17 @@ MIDDLEWARE = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts_app.api.authentication.CachedTokenAuthentication',
     ],
 }
 
+TOKEN_CACHE_TIMEOUT = 60  # seconds a token => user lookup is cached
+TOKEN_LIFETIME = 60 * 60 * 24 * 7  # seconds until a token expires, refresh via /api/token/refresh/
+TOKEN_LAST_USED_INTERVAL = 300  # seconds between writes of last_used_at
+TOKEN_PURGE_BATCH_SIZE = 1000
+
 AUTHENTICATION_BACKENDS = (
-    'django.contrib.auth.backends.ModelBackend',
-    'accounts_app.api.backends.EmailBackend'
+    'accounts_app.api.backends.UsernameOrEmailBackend',
 )
 
 ROOT_URLCONF = "core.urls"
@@ -162,25 +165,105 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
 
+RQ_CONNECTION = {
+    "HOST": REDIS_HOST,
+    "PORT": 6379,
+    "DB": 0,
+    "PASSWORD": "foobared",
+}
+
+# One queue per kind of work, so long transcodes don't hold back thumbnails or mails.
+# The timeouts are sized to the jobs of each queue.
 RQ_QUEUES = {
-    "default": {
-        "HOST": REDIS_HOST,
-        "PORT": 6379,
-        "DB": 0,
-        "PASSWORD": "foobared",
-        "DEFAULT_TIMEOUT": 360,
-    },
-    # 'thumbnails': {
-    #     'HOST': 'localhost',
-    #     'PORT': 6379,
-    #     'DB': 1,
-    #     "PASSWORD": "foobared",
-    #     'DEFAULT_TIMEOUT': 360,
-    # },
+    "default": {**RQ_CONNECTION, "DEFAULT_TIMEOUT": 360},
+    "thumbnails": {**RQ_CONNECTION, "DEFAULT_TIMEOUT": 120},
+    "transcode_short": {**RQ_CONNECTION, "DEFAULT_TIMEOUT": 600},
+    "transcode": {**RQ_CONNECTION, "DEFAULT_TIMEOUT": 3600},
+    "transcode_large": {**RQ_CONNECTION, "DEFAULT_TIMEOUT": 4 * 3600},
+    "mail": {**RQ_CONNECTION, "DEFAULT_TIMEOUT": 60},
+}
+
+# Job type => queue (core.queues.get_queue)
+RQ_QUEUE_ROUTES = {
+    "thumbnail": "thumbnails",
+    "probe": "thumbnails",
+    "transcode_short": "transcode_short",
+    "transcode": "transcode",
+    "transcode_large": "transcode_large",
+    # Packaging only copies the streams, it must not wait behind full encodes
+    "packaging": "transcode_short",
+    "mail": "mail",
+    "maintenance": "default",
 }
 
 RQ_EXCEPTION_HANDLERS = []  # If you need custom exception handlers
 
+# Video conversion
+# "sequential": one job converts all resolutions one after another
+# "fanout": one job per resolution plus a join job that marks the video ready
+# "single_pass": one ffmpeg run decodes the source once and writes all resolutions
+VIDEO_CONVERSION_MODE = "sequential"
+VIDEO_MAX_PARALLEL_RENDITIONS = 2  # max. parallel resolution jobs per upload
+VIDEO_FFMPEG_THREADS = None  # ffmpeg threads per job, None = ffmpeg default
+VIDEO_PROGRESS_INTERVAL = 1.0  # min. seconds between live progress updates
+VIDEO_STREAM_TOKEN_MAX_AGE = 60  # seconds a signed progress stream URL can be opened
+
+# Transcode scheduling: a probe job estimates the cost of every conversion job
+# (duration x pixels relative to 1080p x speed factor) and picks queue and timeout.
+# The transcode workers take transcode_short first, so short clips don't wait
+# behind feature films, transcode_large has its own worker class.
+VIDEO_TRANSCODE_SPEED_FACTOR = 1.5  # worker seconds per second of 1080p output
+VIDEO_SHORT_JOB_SECONDS = 120  # estimates up to this go to transcode_short
+VIDEO_LARGE_JOB_SECONDS = 1800  # estimates from this go to transcode_large
+VIDEO_JOB_TIMEOUT_MARGIN = 3  # job timeout = estimate x margin
+VIDEO_MIN_JOB_TIMEOUT = 360
+# Seconds before each automatic retry of a failed transcode job, finished
+# resolutions are kept and skipped by the retry. RQ schedules delayed retries,
+# so the workers must run with --with-scheduler (see docker-compose.yaml)
+VIDEO_JOB_RETRY_INTERVALS = [30, 120, 300]
+
+# Sources from this duration (seconds) are split at keyframes, the segments are
+# encoded in parallel and joined again, None disables the segmented conversion
+VIDEO_SEGMENTED_MIN_DURATION = 600
+VIDEO_SEGMENT_COUNT = 8  # segments per source, about the number of transcode workers
+VIDEO_MIN_SEGMENT_SECONDS = 60
+
+# Video list pagination
+VIDEO_PAGE_SIZE = 20
+VIDEO_MAX_PAGE_SIZE = 100
+
+# HLS packaging after conversion, segment type "mpegts" or "fmp4" (CMAF)
+VIDEO_HLS_ENABLED = True
+VIDEO_HLS_SEGMENT_TYPE = "mpegts"
+VIDEO_HLS_SEGMENT_SECONDS = 6
+
+# Streaming of converted files: None = Django streams the bytes itself,
+# "x-accel-redirect" (nginx) or "x-sendfile" (Apache) hand the transfer to the proxy
+VIDEO_STREAM_SENDFILE = None
+VIDEO_STREAM_ACCEL_PREFIX = "/protected-media/"  # internal nginx location for MEDIA_ROOT
+
+# Resumable uploads: chunks are appended to a part file, on the same disk as
+# MEDIA_ROOT so the finished file is moved and not copied
+VIDEO_UPLOAD_TEMP_DIR = os.path.join(MEDIA_ROOT, "uploads")
+VIDEO_UPLOAD_MAX_SIZE = None  # max. file size in bytes, None = no limit
+VIDEO_UPLOAD_EXPIRY = 60 * 60 * 24  # seconds until unfinished uploads are deleted
+
+# Lifetime of presigned upload/download URLs in seconds
+VIDEO_PRESIGNED_URL_EXPIRY = 3600
+
+# Object storage (S3, MinIO, ...) via django-storages, clients then upload
+# straight to the bucket and the workers stream from it:
+# STORAGES = {
+#     "default": {
+#         "BACKEND": "storages.backends.s3.S3Storage",
+#         "OPTIONS": {
+#             "bucket_name": os.environ.get("AWS_STORAGE_BUCKET_NAME"),
+#             "endpoint_url": os.environ.get("AWS_S3_ENDPOINT_URL"),  # e.g. http://minio:9000
+#         },
+#     },
+#     "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+# }
+
 CACHES = {
     "default": {
         "BACKEND": "django_redis.cache.RedisCache",
@@ -204,6 +287,12 @@ EMAIL_FILE_PATH = 'received_mails'  # Ersetze dies mit einem Pfad auf deinem Sys
 # EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASSWORD')
 # DEFAULT_FROM_EMAIL = env('DEFAULT_FROM_EMAIL')
 
+# Mails are sent by jobs on the mail queue, in batches over one connection
+# (accounts_app.api.tasks). Tests use Django's locmem backend, locally the
+# file backend above or 'django.core.mail.backends.console.EmailBackend'.
+MAIL_BATCH_SIZE = 100
+MAIL_RETRY_INTERVALS = [10, 60, 300]  # seconds before each retry of a failed batch, needs rqworker --with-scheduler
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
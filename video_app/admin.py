@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Video, VideoResolution
+from .models import Video, VideoResolution, VideoUpload
 from import_export import resources
 from import_export.admin import ImportExportModelAdmin
 
@@ -17,6 +17,10 @@ class VideoAdmin(ImportExportModelAdmin):
 class VideoResolutionAdmin(admin.ModelAdmin):
     list_display = ['original_video', 'resolution', 'converted_file']
 
+@admin.register(VideoUpload)
+class VideoUploadAdmin(admin.ModelAdmin):
+    list_display = ['filename', 'user', 'offset', 'size', 'video', 'created_at']
+
 class VideoResource(resources.ModelResource):
     class Meta:
         model = Video
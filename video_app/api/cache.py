@@ -0,0 +1,99 @@
+import math
+import random
+import time
+from urllib.parse import urlencode
+from django.core.cache import cache
+
+CATALOGUE_GENERATION_KEY = "videos:generation"
+CACHE_TIMEOUT = 300
+STALE_TIMEOUT = 60  # how long an expired entry may still be served during a rebuild
+REBUILD_LOCK_TIMEOUT = 10
+REBUILD_WAIT_TIMEOUT = 5
+
+
+def get_video_cache_key(pk):
+    return f"videos:detail:{pk}"
+
+
+def get_catalogue_generation():
+    """
+    Return the current catalogue generation, all page keys contain it.
+    A missing counter starts at the current time, so it can't fall back to an
+    older generation whose pages are still cached.
+    """
+    generation = cache.get(CATALOGUE_GENERATION_KEY)
+    if generation is None:
+        cache.add(CATALOGUE_GENERATION_KEY, int(time.time() * 1000), timeout=None)
+        generation = cache.get(CATALOGUE_GENERATION_KEY)
+    return generation
+
+
+def bump_catalogue_generation():
+    """
+    Move all list pages to a new generation, the old pages simply expire.
+    """
+    if not cache.add(CATALOGUE_GENERATION_KEY, int(time.time() * 1000), timeout=None):
+        cache.incr(CATALOGUE_GENERATION_KEY)
+
+
+def get_page_cache_key(filters, cursor, page_size):
+    """
+    Return the cache key for one page of the video list.
+    Example: ({"genre": "Action"}, None, 20) => "videos:v7:page:genre=Action&page_size=20"
+    """
+    params = dict(filters, page_size=page_size)
+    if cursor:
+        params["cursor"] = cursor
+    return f"videos:v{get_catalogue_generation()}:page:{urlencode(sorted(params.items()))}"
+
+
+def invalidate_video(pk):
+    """
+    Drop the cached entry of one video and of its duplicate uploads, which show
+    the same media, and start a new page generation.
+    """
+    from video_app.models import Video
+
+    duplicate_pks = Video.objects.filter(duplicate_of_id=pk).values_list("pk", flat=True)
+    cache.delete_many([get_video_cache_key(key) for key in [pk, *duplicate_pks]])
+    bump_catalogue_generation()
+
+
+def clear_catalogue_cache():
+    cache.delete_pattern(get_video_cache_key("*"))
+    bump_catalogue_generation()
+
+
+def get_or_rebuild(key, rebuild, timeout=CACHE_TIMEOUT, beta=1.0):
+    """
+    Return the cached value of `key` and let only one request rebuild it.
+    Entries are refreshed early with a probability that grows towards the expiry
+    (XFetch), the others get the stale value or wait for the rebuilding request.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        value, rebuild_seconds, expires_at = entry
+        early_by = -rebuild_seconds * beta * math.log(1.0 - random.random())
+        if time.time() + early_by < expires_at:
+            return value
+
+    lock_key = f"{key}:lock"
+    if cache.add(lock_key, 1, timeout=REBUILD_LOCK_TIMEOUT):
+        try:
+            started = time.time()
+            value = rebuild()
+            now = time.time()
+            cache.set(key, (value, now - started, now + timeout), timeout=timeout + STALE_TIMEOUT)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    if entry is not None:
+        return entry[0]
+    deadline = time.time() + REBUILD_WAIT_TIMEOUT
+    while time.time() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+    return rebuild()
@@ -0,0 +1,53 @@
+import base64
+from datetime import datetime
+from django.db.models import Q
+
+VIDEO_FILTER_FIELDS = ["genre", "category", "status"]
+
+
+def encode_cursor(uploaded_at, pk):
+    """
+    Encode the position after a video as an opaque cursor.
+    """
+    raw = f"{uploaded_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor into (uploaded_at, pk), raises ValueError for invalid cursors.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        uploaded_at, pk = raw.split("|")
+        return datetime.fromisoformat(uploaded_at), int(pk)
+    except (UnicodeDecodeError, ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor.") from e
+
+
+def get_page_size(value, default, maximum):
+    try:
+        return max(1, min(int(value), maximum))
+    except (TypeError, ValueError):
+        return default
+
+
+def paginate_videos(queryset, cursor, page_size):
+    """
+    Return one page of videos ordered by (uploaded_at, id) descending and the
+    cursor of the next page. The page is found with a keyset condition instead of
+    an OFFSET, so every page costs the same no matter how deep it is.
+    """
+    queryset = queryset.order_by("-uploaded_at", "-id")
+    if cursor:
+        uploaded_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, id__lt=pk)
+        )
+    videos = list(queryset[: page_size + 1])
+    next_cursor = None
+    if len(videos) > page_size:
+        videos = videos[:page_size]
+        next_cursor = encode_cursor(videos[-1].uploaded_at, videos[-1].pk)
+    return videos, next_cursor
+
@@ -0,0 +1,154 @@
+import json
+import logging
+import time
+import django_rq
+import redis.asyncio
+from django.conf import settings
+from django.core import signing
+
+logger = logging.getLogger(__name__)
+
+
+PROGRESS_STATE_TIMEOUT = 3600
+STREAM_TOKEN_SALT = "video_app.progress_stream"
+
+
+def get_progress_channel(video_id):
+    return f"video_progress:{video_id}"
+
+
+def get_progress_state_key(video_id):
+    return f"video_progress_state:{video_id}"
+
+
+def get_stream_token(user_id, video_id):
+    """
+    Short-lived token for the URL of a progress stream. EventSource can't send the
+    Authorization header, and the real auth token must not end up in access logs.
+    """
+    return signing.dumps({"user": user_id, "video": video_id}, salt=STREAM_TOKEN_SALT)
+
+
+def load_stream_token(token, video_id):
+    """
+    Return the user id of a stream token, raises signing.BadSignature if the token
+    is invalid, expired or for another video.
+    """
+    data = signing.loads(
+        token, salt=STREAM_TOKEN_SALT, max_age=getattr(settings, "VIDEO_STREAM_TOKEN_MAX_AGE", 60)
+    )
+    if data.get("video") != video_id:
+        raise signing.BadSignature("Token not valid for this video.")
+    return data["user"]
+
+
+def get_progress_payload(video_id, status, progress, current_resolution):
+    return {
+        "video_id": video_id,
+        "status": status,
+        "progress": progress,
+        "current_resolution": current_resolution,
+    }
+
+
+def is_final_progress(payload):
+    """
+    Check if no further progress messages will follow.
+    """
+    return payload["status"] == "failed" or payload["progress"] >= 100
+
+
+def publish_progress(payload):
+    """
+    Store the latest progress of a video in Redis and publish it to its channel.
+    Publishing is best effort, a missing Redis must not break the conversion.
+    """
+    message = json.dumps(payload)
+    try:
+        pipeline = django_rq.get_connection("default").pipeline()
+        pipeline.set(get_progress_state_key(payload["video_id"]), message, ex=PROGRESS_STATE_TIMEOUT)
+        pipeline.publish(get_progress_channel(payload["video_id"]), message)
+        pipeline.execute()
+    except Exception as e:
+        logger.warning(f"Failed to publish progress for video {payload['video_id']}: {e}")
+
+
+def publish_video_progress(video_instance):
+    publish_progress(
+        get_progress_payload(
+            video_instance.id,
+            video_instance.status,
+            video_instance.conversion_progress,
+            video_instance.current_resolution,
+        )
+    )
+
+
+def get_progress_state(video_id):
+    """
+    Return the latest published progress of a video or None.
+    """
+    try:
+        message = django_rq.get_connection("default").get(get_progress_state_key(video_id))
+    except Exception as e:
+        logger.warning(f"Failed to read progress for video {video_id}: {e}")
+        return None
+    return json.loads(message) if message else None
+
+
+def delete_progress_state(video_id):
+    try:
+        django_rq.get_connection("default").delete(get_progress_state_key(video_id))
+    except Exception as e:
+        logger.warning(f"Failed to delete progress for video {video_id}: {e}")
+
+
+class ConversionProgressReporter:
+    """
+    Turn the encoded fraction of running rungs into the overall video progress.
+    Updates are only published to Redis and at most once per `interval` seconds,
+    the database is written when a rung is finished.
+    """
+
+    def __init__(self, video_instance, done, total, current_resolution, interval=None):
+        self.video_instance = video_instance
+        self.done = done
+        self.total = total
+        self.current_resolution = current_resolution
+        self.interval = interval if interval is not None else getattr(
+            settings, "VIDEO_PROGRESS_INTERVAL", 1.0
+        )
+        self.last_report = None
+
+    def report(self, fraction):
+        now = time.monotonic()
+        if self.last_report is not None and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        # 100 is only reached when the conversion is saved, it ends the SSE stream
+        progress = min(int((self.done + fraction) / self.total * 100), 99)
+        publish_progress(
+            get_progress_payload(
+                self.video_instance.id,
+                self.video_instance.status,
+                progress,
+                self.current_resolution,
+            )
+        )
+
+
+def get_async_redis():
+    """
+    Return an asyncio Redis client for the connection configured in RQ_QUEUES.
+    """
+    config = settings.RQ_QUEUES["default"]
+    return redis.asyncio.Redis(
+        host=config["HOST"],
+        port=config["PORT"],
+        db=config["DB"],
+        password=config.get("PASSWORD"),
+    )
+
+
+def format_sse(payload, event="progress"):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
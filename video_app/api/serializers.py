@@ -1,15 +1,25 @@
+from django.urls import reverse
 from rest_framework import serializers
-from video_app.models import Video, VideoResolution
+from django.conf import settings
+from django.core.files.storage import default_storage
+from video_app.models import Video, VideoResolution, VideoUpload
+from .utils import get_base_name_and_extension, is_valid_video_extension
 
 
 class VideoResolutionSerializer(serializers.ModelSerializer):
+    stream_url = serializers.SerializerMethodField()
+
     class Meta:
         model = VideoResolution
-        fields = ["id", "original_video", "resolution", "converted_file"]
+        fields = ["id", "original_video", "resolution", "converted_file", "stream_url"]
+
+    def get_stream_url(self, obj):
+        return reverse("video-resolution-stream", args=[obj.pk])
 
 
 class VideoSerializer(serializers.ModelSerializer):
     resolutions = VideoResolutionSerializer(many=True, read_only=True)
+    thumbnail_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Video
@@ -22,10 +32,31 @@ class VideoSerializer(serializers.ModelSerializer):
             "category",
             "video_file",
             "thumbnail",
+            "thumbnail_variants",
             "conversion_progress",
             "current_resolution",
             "resolutions",
+            "hls_playlist",
+            "duration",
+            "width",
+            "height",
         ]
+        read_only_fields = ["hls_playlist", "duration", "width", "height"]
+
+    def get_thumbnail_variants(self, obj):
+        return {
+            size: {image_format: default_storage.url(name) for image_format, name in formats.items()}
+            for size, formats in (obj.thumbnail_variants or {}).items()
+        }
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.duplicate_of_id:
+            original = super().to_representation(instance.media_source)
+            for field in ["resolutions", *Video.MEDIA_FIELDS]:
+                if field in data:
+                    data[field] = original[field]
+        return data
 
     def validate_video_file(self, value):
         ext = value.name.split(".")[-1].lower()
@@ -47,3 +78,35 @@ class VideoSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(errors)
         return data
 
+
+
+class VideoUploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = VideoUpload
+        fields = [
+            "id",
+            "filename",
+            "size",
+            "offset",
+            "title",
+            "description",
+            "genre",
+            "category",
+            "storage_name",
+            "video",
+            "created_at",
+        ]
+        read_only_fields = ["offset", "storage_name", "video", "created_at"]
+
+    def validate_filename(self, value):
+        _, extension = get_base_name_and_extension(value)
+        if not is_valid_video_extension(extension):
+            raise serializers.ValidationError("Unsupported file type.")
+        return value
+
+    def validate_size(self, value):
+        if value == 0:
+            raise serializers.ValidationError("The file is empty.")
+        if settings.VIDEO_UPLOAD_MAX_SIZE and value > settings.VIDEO_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError("The file is too large.")
+        return value
@@ -1,10 +1,17 @@
 import logging
-from django.db.models.signals import post_save, pre_delete
+import os
+from functools import partial
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.core.files.storage import default_storage
-from video_app.models import Video
-from .tasks import convert_video, create_thumbnail
-import django_rq
+from video_app.models import Video, VideoResolution, VideoUpload
+from .cache import invalidate_video
+from .progress import delete_progress_state
+from .storage import delete_storage_directory
+from .uploads import delete_upload_part
+from .tasks import create_thumbnail, schedule_conversion
+from core.queues import get_queue
 
 logger = logging.getLogger(__name__)
 
@@ -12,19 +19,42 @@ logger = logging.getLogger(__name__)
 @receiver(post_save, sender=Video)
 def video_post_save(sender, instance, created, **kwargs):
     logger.info(f"Video {instance.title} saved")
-    if created:
-        try:
-            logger.info(f"Video {instance.title} uploaded")
-            thumbnails_queue = django_rq.get_queue("default", autocommit=True)
-            videos_queue = django_rq.get_queue("default", autocommit=True)
-            thumbnails_queue.enqueue(create_thumbnail, instance.id)
-            videos_queue.enqueue(convert_video, instance.id)
-        except Exception as e:
-            logger.error(f"Failed to enqueue tasks: {e}")
+    if created and instance.duplicate_of_id:
+        logger.info(f"Video {instance.title} duplicates video {instance.duplicate_of_id}, nothing to convert")
+    elif created:
+        logger.info(f"Video {instance.title} uploaded")
+        # After the commit, a worker that starts right away must find the video
+        transaction.on_commit(partial(enqueue_video_jobs, instance.id))
+
+
+def enqueue_video_jobs(video_id):
+    try:
+        get_queue("thumbnail").enqueue(create_thumbnail, video_id)
+        get_queue("probe").enqueue(schedule_conversion, video_id)
+    except Exception as e:
+        logger.error(f"Failed to enqueue tasks: {e}")
+
+
+@receiver(post_save, sender=Video)
+@receiver(post_delete, sender=Video)
+def video_invalidate_cache(sender, instance, **kwargs):
+    invalidate_video(instance.pk)
+
+
+@receiver(post_save, sender=VideoResolution)
+@receiver(post_delete, sender=VideoResolution)
+def video_resolution_invalidate_cache(sender, instance, **kwargs):
+    if instance.original_video_id:
+        invalidate_video(instance.original_video_id)
 
 
 @receiver(pre_delete, sender=Video)
 def video_pre_delete(sender, instance, **kwargs):
+    delete_progress_state(instance.id)
+    # Files of a duplicate belong to the original, files with duplicates left
+    # are still in use (Video.delete hands them over, bulk deletes don't)
+    if instance.duplicate_of_id or instance.duplicates.exists():
+        return
     resolutions = instance.resolutions.all()
     if instance.video_file and default_storage.exists(instance.video_file.name):
         default_storage.delete(instance.video_file.name)
@@ -37,3 +67,20 @@ def video_pre_delete(sender, instance, **kwargs):
     if instance.thumbnail and default_storage.exists(instance.thumbnail.name):
         default_storage.delete(instance.thumbnail.name)
         logger.info(f"Thumbnail {instance.thumbnail.name} deleted from storage.")
+    for formats in (instance.thumbnail_variants or {}).values():
+        for name in formats.values():
+            if default_storage.exists(name):
+                default_storage.delete(name)
+    if instance.hls_playlist:
+        delete_storage_directory(os.path.dirname(instance.hls_playlist.name))
+        logger.info(f"HLS files of video {instance.id} deleted from storage.")
+
+
+@receiver(post_delete, sender=VideoUpload)
+def video_upload_post_delete(sender, instance, **kwargs):
+    delete_upload_part(instance)
+    # A presigned upload that never became a video leaves its object in the storage
+    name = instance.storage_name
+    if name and not Video.objects.filter(video_file=name).exists() and default_storage.exists(name):
+        default_storage.delete(name)
+        logger.info(f"Unfinished upload {name} deleted from storage.")
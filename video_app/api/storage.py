@@ -0,0 +1,177 @@
+import os
+import posixpath
+import shutil
+import tempfile
+from contextlib import contextmanager
+from django.conf import settings
+from django.core import signing
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from .utils import is_complete_output
+
+
+SIGNING_SALT = "video_app.storage"
+
+
+def get_local_path(name):
+    """
+    Local path of a stored file, None if the storage has no file system (S3 & co).
+    """
+    try:
+        return default_storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def is_remote_storage():
+    return get_local_path("") is None
+
+
+def get_presigned_url_expiry():
+    return getattr(settings, "VIDEO_PRESIGNED_URL_EXPIRY", 3600)
+
+
+def _get_s3_client():
+    """
+    The boto3 client of an S3 compatible storage (django-storages), otherwise None.
+    """
+    bucket = getattr(default_storage, "bucket", None)
+    return bucket.meta.client if bucket is not None else None
+
+
+def get_presigned_upload_url(name, size, expires=None):
+    """
+    URL the client PUTs the file of `size` bytes to without going through Django.
+    Falls back to a signed local endpoint for the file system storage.
+    """
+    expires = expires or get_presigned_url_expiry()
+    client = _get_s3_client()
+    if client is not None:
+        # ContentLength is part of the signature, S3 refuses other sizes
+        key = posixpath.join(getattr(default_storage, "location", ""), name).lstrip("/")
+        return client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": default_storage.bucket_name, "Key": key, "ContentLength": size},
+            ExpiresIn=expires,
+        )
+    token = signing.dumps({"name": name, "method": "PUT", "size": size}, salt=SIGNING_SALT)
+    return reverse("storage-object", args=[token])
+
+
+def get_presigned_download_url(name, expires=None):
+    """
+    Time limited URL to read a stored file, used by ffmpeg and for redirects.
+    """
+    expires = expires or get_presigned_url_expiry()
+    if _get_s3_client() is not None:
+        return default_storage.url(name, expire=expires)
+    if is_remote_storage():
+        return default_storage.url(name)
+    token = signing.dumps({"name": name, "method": "GET"}, salt=SIGNING_SALT)
+    return reverse("storage-object", args=[token])
+
+
+def load_presigned_token(token, method):
+    """
+    Return the data of a local presigned URL ("name" and for uploads "size"),
+    raises signing.BadSignature if the token is invalid, expired or for another method.
+    """
+    data = signing.loads(token, salt=SIGNING_SALT, max_age=get_presigned_url_expiry())
+    if data.get("method") != method:
+        raise signing.BadSignature("Token not valid for this method.")
+    return data
+
+
+def get_input_path(name):
+    """
+    Path or URL ffmpeg reads a stored file from. Remote files are streamed from a
+    presigned URL, the worker doesn't need a shared file system.
+    """
+    return get_local_path(name) or get_presigned_download_url(name)
+
+
+def is_stored_output_complete(name):
+    """
+    Check if a stored output exists and isn't empty. Outputs only get their final
+    name after a successful run, so an existing one is finished.
+    """
+    local_path = get_local_path(name)
+    if local_path:
+        return is_complete_output(local_path)
+    return default_storage.exists(name) and default_storage.size(name) > 0
+
+
+def get_partial_path(path):
+    """
+    Temporary name next to an output, the extension stays for ffmpeg's format detection.
+    Example: "videos/foo_720p.mp4" => "videos/foo_720p.partial.mp4"
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}.partial{extension}"
+
+
+@contextmanager
+def storage_output(name):
+    """
+    Yield a local path to write the stored file `name` to. It's renamed to `name`
+    only when the block finishes without error, a crashed run leaves no output
+    behind that looks finished. On a remote storage the file is uploaded instead.
+    """
+    local_path = get_local_path(name)
+    if local_path:
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        partial_path = get_partial_path(local_path)
+        try:
+            yield partial_path
+        except BaseException:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+            raise
+        if os.path.exists(partial_path):
+            os.replace(partial_path, local_path)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, os.path.basename(name))
+        yield path
+        with open(path, "rb") as f:
+            default_storage.save(name, File(f))
+
+
+@contextmanager
+def storage_output_directory(directory):
+    """
+    Like storage_output for a whole directory, e.g. HLS playlists and segments.
+    """
+    local_path = get_local_path(directory)
+    if local_path:
+        os.makedirs(local_path, exist_ok=True)
+        yield local_path
+        return
+    tmp = tempfile.mkdtemp()
+    try:
+        yield tmp
+        for root, _, files in os.walk(tmp):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                name = f"{directory}/{os.path.relpath(path, tmp).replace(os.sep, '/')}"
+                with open(path, "rb") as f:
+                    default_storage.save(name, File(f))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def delete_storage_directory(directory):
+    """
+    Delete all files below a storage directory. Object storages have no directories,
+    exists() is False for a prefix there, so only listdir() is asked.
+    """
+    try:
+        subdirectories, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for subdirectory in subdirectories:
+        delete_storage_directory(f"{directory}/{subdirectory}")
+    for file_name in files:
+        default_storage.delete(f"{directory}/{file_name}")
+    default_storage.delete(directory)
@@ -1,14 +1,49 @@
 import logging
+import os
 import subprocess
+import tempfile
+from contextlib import ExitStack
+from datetime import timedelta
+from django.conf import settings
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
-from video_app.models import Video, VideoResolution
+from django.utils import timezone
+from rq import Retry, get_current_job
+from core.queues import get_queue
+from video_app.models import Video, VideoResolution, VideoUpload
+from .cache import invalidate_video
+from .progress import ConversionProgressReporter, publish_video_progress
+from .storage import (
+    delete_storage_directory,
+    get_input_path,
+    is_stored_output_complete,
+    storage_output,
+    storage_output_directory,
+)
 from .utils import (
     get_base_name_and_extension,
     build_output_filename,
     is_valid_video_extension,
     get_ffmpeg_thumbnail_command,
+    THUMBNAIL_FORMATS,
+    THUMBNAIL_VARIANTS,
     get_ffmpeg_convert_command,
+    get_ffmpeg_multi_convert_command,
+    is_complete_output,
+    get_ffmpeg_hls_command,
+    parse_hls_segments,
+    build_hls_master_playlist,
+    get_ffprobe_command,
+    parse_ffprobe_output,
+    plan_resolutions,
+    get_ffmpeg_copy_command,
+    add_ffmpeg_progress_output,
+    parse_ffmpeg_progress_seconds,
+    estimate_transcode_seconds,
+    get_segment_seconds,
+    get_ffmpeg_segment_command,
+    build_concat_list,
+    get_ffmpeg_concat_command,
 )
 
 logger = logging.getLogger(__name__)
@@ -16,12 +51,16 @@ logger = logging.getLogger(__name__)
 RESOLUTIONS = [("120p", 120), ("360p", 360), ("720p", 720), ("1080p", 1080)]
 
 
+class IncompleteOutputError(Exception):
+    pass
+
+
 def create_thumbnail(video_id):
     """
-    Create and save a thumbnail image for a given video.
+    Create the thumbnail and its smaller variants of a given video in one ffmpeg run.
+    The images are written to their final storage names and stored with one UPDATE.
     """
     video_instance = None
-    output_filename = None
     try:
         video_instance = Video.objects.get(id=video_id)
         input_file = video_instance.video_file
@@ -30,19 +69,31 @@ def create_thumbnail(video_id):
             set_video_failed(video_instance)
             return
 
-        base_name, _ = get_base_name_and_extension(input_file.name)
-        output_filename = build_output_filename(base_name, "thumbnail", "jpg")
-        input_path = default_storage.path(input_file.name)
-        output_path = default_storage.path(output_filename)
-        command = get_ffmpeg_thumbnail_command(input_path, output_path)
-
-        subprocess.run(command, check=True)
-        with open(output_path, "rb") as f:
-            video_instance.thumbnail.save(
-                output_filename, ContentFile(f.read()), save=True
+        base_name, _ = get_base_name_and_extension(os.path.basename(input_file.name))
+        thumbnail_name = build_output_filename(f"thumbnails/{base_name}", "thumbnail", "jpg")
+        variants = {
+            size: {
+                image_format: build_output_filename(f"thumbnails/{base_name}", f"thumbnail_{size}", image_format)
+                for image_format in THUMBNAIL_FORMATS
+            }
+            for size, _ in THUMBNAIL_VARIANTS
+        }
+        widths = dict(THUMBNAIL_VARIANTS)
+        with ExitStack() as stack:
+            output_path = stack.enter_context(storage_output(thumbnail_name))
+            variant_outputs = [
+                (stack.enter_context(storage_output(name)), widths[size])
+                for size, formats in variants.items()
+                for name in formats.values()
+            ]
+            command = get_ffmpeg_thumbnail_command(
+                get_input_path(input_file.name), output_path, variant_outputs
             )
-        logger.info(f"Thumbnail created and saved to {output_filename}")
-        video_instance.save()
+            subprocess.run(command, check=True)
+        video_instance.set_thumbnails(thumbnail_name, variants)
+        # post_save is skipped, so the cache is invalidated here
+        invalidate_video(video_instance.id)
+        logger.info(f"Thumbnail created and saved to {thumbnail_name}")
     except subprocess.CalledProcessError as e:
         logger.error(f"Failed to create thumbnail: {e}")
         if video_instance:
@@ -51,9 +102,102 @@ def create_thumbnail(video_id):
         logger.error(f"General error in create_thumbnail: {e}")
         if video_instance:
             set_video_failed(video_instance)
-    finally:
-        if output_filename and default_storage.exists(output_filename):
-            default_storage.delete(output_filename)
+
+
+def schedule_conversion(video_id):
+    """
+    Fast job before the conversion: probe the source, then enqueue the conversion
+    with a queue and timeout that fit its estimated cost.
+    """
+    video_instance = None
+    try:
+        video_instance = Video.objects.get(id=video_id)
+        probe_video_source(video_instance)
+        if is_segmented_conversion(video_instance):
+            enqueue_transcode(split_video_source, None, video_id)
+            logger.info(f"Conversion of video {video_id} scheduled in segments")
+            return
+        task = get_conversion_task()
+        if task is fan_out_convert_video:
+            # Only enqueues the rungs, each with its own estimate
+            fan_out_convert_video(video_id)
+            return
+        estimate = estimate_conversion_seconds(video_instance, get_resolution_plan(video_instance))
+        enqueue_transcode(task, estimate, video_id)
+        logger.info(f"Conversion of video {video_id} scheduled, estimated {estimate} s")
+    except Exception as e:
+        logger.error(f"General error in schedule_conversion: {e}")
+        if video_instance:
+            set_video_failed(video_instance)
+
+
+def estimate_conversion_seconds(video_instance, plan):
+    return estimate_transcode_seconds(
+        video_instance.duration, plan, getattr(settings, "VIDEO_TRANSCODE_SPEED_FACTOR", 1.0)
+    )
+
+
+def get_transcode_route(estimate):
+    """
+    Job type of a transcode by its estimated seconds, unknown estimates use "transcode".
+    """
+    if estimate is None:
+        return "transcode"
+    if estimate <= getattr(settings, "VIDEO_SHORT_JOB_SECONDS", 120):
+        return "transcode_short"
+    if estimate >= getattr(settings, "VIDEO_LARGE_JOB_SECONDS", 1800):
+        return "transcode_large"
+    return "transcode"
+
+
+def get_transcode_timeout(estimate):
+    """
+    Job timeout for an estimate, None keeps the DEFAULT_TIMEOUT of the queue.
+    """
+    if estimate is None:
+        return None
+    return max(
+        getattr(settings, "VIDEO_MIN_JOB_TIMEOUT", 360),
+        int(estimate * getattr(settings, "VIDEO_JOB_TIMEOUT_MARGIN", 3)),
+    )
+
+
+def get_transcode_retry():
+    intervals = getattr(settings, "VIDEO_JOB_RETRY_INTERVALS", [])
+    return Retry(max=len(intervals), interval=intervals) if intervals else None
+
+
+def enqueue_transcode(func, estimate, *args, **kwargs):
+    return get_queue(get_transcode_route(estimate)).enqueue(
+        func,
+        *args,
+        job_timeout=get_transcode_timeout(estimate),
+        retry=get_transcode_retry(),
+        **kwargs,
+    )
+
+
+def fail_or_retry(video_instance, error):
+    """
+    Raise the error again while RQ has retries left for the current job, the retry
+    skips the finished resolutions. The video is only marked failed after the last attempt.
+    """
+    job = get_current_job()
+    if job is not None and job.retries_left:
+        logger.warning(f"Retrying conversion of video {video_instance.id}, {job.retries_left} attempts left")
+        raise error
+    set_video_failed(video_instance)
+
+
+def save_resolution(video_instance, res_label, output_filename):
+    """
+    Record a converted resolution, a second run updates the row instead of adding one.
+    """
+    VideoResolution.objects.update_or_create(
+        original_video=video_instance,
+        resolution=res_label,
+        defaults={"converted_file": output_filename},
+    )
 
 
 def convert_video(video_id):
@@ -70,48 +214,528 @@ def convert_video(video_id):
             set_video_failed(video_instance)
             return
 
-        total_resolutions = len(RESOLUTIONS)
-        for index, (res_label, res_height) in enumerate(RESOLUTIONS):
+        probe_video_source(video_instance)
+        plan = get_resolution_plan(video_instance)
+        total_resolutions = len(plan)
+        for index, (res_label, res_height, copy) in enumerate(plan):
             output_filename = build_output_filename(base_name, res_label, extension)
-            input_path = default_storage.path(input_file.name)
-            output_path = default_storage.path(output_filename)
-            command = get_ffmpeg_convert_command(input_path, output_path, res_height)
+            if is_stored_output_complete(output_filename):
+                logger.info(f"Skipping {res_label} of video {video_id}, already converted")
+            else:
+                reporter = ConversionProgressReporter(
+                    video_instance, index, total_resolutions, res_label
+                )
+                with storage_output(output_filename) as output_path:
+                    command = get_rendition_command(
+                        get_input_path(input_file.name), output_path, res_height, copy
+                    )
+                    run_ffmpeg_with_progress(command, video_instance.duration, reporter.report)
+                logger.info(f"Video converted and saved to {output_filename}")
+            save_resolution(video_instance, res_label, output_filename)
+            update_video_progress(
+                video_instance, index + 1, total_resolutions, res_label
+            )
+        enqueue_packaging(video_id)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Failed to convert video {video_id}: {e}")
+        if video_instance:
+            fail_or_retry(video_instance, e)
+    except Exception as e:
+        logger.error(f"General error in convert_video: {e}")
+        if video_instance:
+            fail_or_retry(video_instance, e)
 
-            try:
-                subprocess.run(command, check=True)
-                VideoResolution.objects.create(
-                    original_video=video_instance,
-                    resolution=res_label,
-                    converted_file=output_filename,
+
+def convert_video_single_pass(video_id):
+    """
+    Convert the original video to all resolutions with a single ffmpeg run.
+    The source is decoded once, returns a dict with the success of every output.
+    """
+    video_instance = None
+    results = {}
+    outputs = []
+    try:
+        video_instance = Video.objects.get(id=video_id)
+        input_file = video_instance.video_file
+        base_name, extension = get_base_name_and_extension(input_file.name)
+        if not is_valid_video_extension(extension):
+            logger.error("Unsupported video file format.")
+            set_video_failed(video_instance)
+            return results
+
+        probe_video_source(video_instance)
+        plan = get_resolution_plan(video_instance)
+        output_filenames = {
+            res_label: build_output_filename(base_name, res_label, extension) for res_label, _, _ in plan
+        }
+        with ExitStack() as stack:
+            for res_label, res_height, copy in plan:
+                output_filename = output_filenames[res_label]
+                if is_stored_output_complete(output_filename):
+                    # Converted by an earlier attempt, not part of this run
+                    results[res_label] = True
+                    continue
+                output_path = stack.enter_context(storage_output(output_filename))
+                outputs.append((res_label, None if copy else res_height, output_filename, output_path))
+            if outputs:
+                command = get_ffmpeg_multi_convert_command(
+                    get_input_path(input_file.name),
+                    [(output_path, res_height) for _, res_height, _, output_path in outputs],
+                    threads=getattr(settings, "VIDEO_FFMPEG_THREADS", None),
                 )
-                update_video_progress(
-                    video_instance, index + 1, total_resolutions, res_label
+                reporter = ConversionProgressReporter(video_instance, 0, 1, plan[-1][0])
+
+                returncode = run_ffmpeg_with_progress(
+                    command, video_instance.duration, reporter.report, check=False
                 )
-                logger.info(f"Video converted and saved to {output_path}")
-            except subprocess.CalledProcessError as e:
-                logger.error(f"Failed to convert video to {res_label}: {e}")
-                set_video_failed(video_instance)
-                return
+                for res_label, _, _, output_path in outputs:
+                    results[res_label] = returncode == 0 and is_complete_output(output_path)
+                    logger.info(f"Output {res_label}: {'ok' if results[res_label] else 'failed'}")
+
+            failed = [label for label, success in results.items() if not success]
+            if failed:
+                # Raised inside the block, so no output gets its final name
+                raise IncompleteOutputError(f"Failed to convert video to {', '.join(failed)}")
+
+        for res_label, output_filename in output_filenames.items():
+            save_resolution(video_instance, res_label, output_filename)
+        update_video_progress(video_instance, len(plan), len(plan), plan[-1][0])
+        logger.info(f"Video {video_id} converted in a single pass")
+        enqueue_packaging(video_id)
     except Exception as e:
-        logger.error(f"General error in convert_video: {e}")
+        logger.error(f"Error in convert_video_single_pass: {e}")
+        if video_instance:
+            fail_or_retry(video_instance, e)
+    return results
+
+
+def probe_video_source(video_instance):
+    """
+    Store duration, size, codec and bitrate of the uploaded source on the video.
+    Runs ffprobe only once per video, unknown metadata leaves the fields empty.
+    """
+    if video_instance.duration is not None:
+        return
+    input_path = get_input_path(video_instance.video_file.name)
+    try:
+        result = subprocess.run(
+            get_ffprobe_command(input_path),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        metadata = parse_ffprobe_output(result.stdout)
+    except (subprocess.CalledProcessError, OSError, TypeError, ValueError) as e:
+        logger.warning(f"Failed to probe {input_path}: {e}")
+        return
+    for field, value in metadata.items():
+        setattr(video_instance, field, value)
+    video_instance.save(update_fields=list(metadata))
+    logger.info(f"Probed video {video_instance.id}: {metadata}")
+
+
+def get_resolution_plan(video_instance):
+    """
+    Return (label, height, copy) for every resolution of this video's ladder.
+    """
+    return plan_resolutions(RESOLUTIONS, video_instance.height, video_instance.video_codec)
+
+
+def get_rendition_command(input_path, output_path, height, copy=False):
+    if copy:
+        return get_ffmpeg_copy_command(input_path, output_path)
+    return get_ffmpeg_convert_command(
+        input_path,
+        output_path,
+        height,
+        threads=getattr(settings, "VIDEO_FFMPEG_THREADS", None),
+    )
+
+
+def run_ffmpeg_with_progress(command, duration=None, on_progress=None, check=True):
+    """
+    Run ffmpeg and call `on_progress` with the encoded fraction while it runs.
+    Without a duration only the exit code is reported. Returns the exit code,
+    with check=True a failure raises CalledProcessError like subprocess.run.
+    """
+    command = add_ffmpeg_progress_output(command)
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    try:
+        for line in process.stdout:
+            seconds = parse_ffmpeg_progress_seconds(line)
+            if seconds is not None and duration and on_progress:
+                on_progress(min(seconds / duration, 1.0))
+    except BaseException:
+        # A failing callback or a job timeout must not leave ffmpeg running
+        process.kill()
+        process.wait()
+        raise
+    returncode = process.wait()
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    return returncode
+
+
+def get_conversion_task():
+    """
+    Return the conversion task for the configured VIDEO_CONVERSION_MODE.
+    """
+    mode = getattr(settings, "VIDEO_CONVERSION_MODE", "sequential")
+    return {
+        "fanout": fan_out_convert_video,
+        "single_pass": convert_video_single_pass,
+    }.get(mode, convert_video)
+
+
+def get_rendition_chains(resolutions, max_parallel):
+    """
+    Split the resolution ladder into at most `max_parallel` chains.
+    Rungs inside a chain run one after another, the chains run in parallel.
+    Example: 4 rungs, max_parallel=2 => [[120p, 720p], [360p, 1080p]]
+    """
+    chain_count = max(1, min(max_parallel, len(resolutions)))
+    return [resolutions[i::chain_count] for i in range(chain_count)]
+
+
+def fan_out_convert_video(video_id):
+    """
+    Enqueue one conversion job per resolution and a join job that marks the video ready.
+    """
+    video_instance = None
+    try:
+        video_instance = Video.objects.get(id=video_id)
+        _, extension = get_base_name_and_extension(video_instance.video_file.name)
+        if not is_valid_video_extension(extension):
+            logger.error("Unsupported video file format.")
+            set_video_failed(video_instance)
+            return
+
+        probe_video_source(video_instance)
+        max_parallel = getattr(settings, "VIDEO_MAX_PARALLEL_RENDITIONS", 2)
+        chain_tails = []
+        for chain in get_rendition_chains(get_resolution_plan(video_instance), max_parallel):
+            previous_job = None
+            for rung in chain:
+                res_label, res_height, copy = rung
+                previous_job = enqueue_transcode(
+                    convert_video_resolution,
+                    estimate_conversion_seconds(video_instance, [rung]),
+                    video_id,
+                    res_label,
+                    res_height,
+                    copy,
+                    depends_on=previous_job,
+                )
+            chain_tails.append(previous_job)
+        get_queue("transcode_short").enqueue(finalize_video_conversion, video_id, depends_on=chain_tails)
+    except Exception as e:
+        logger.error(f"General error in fan_out_convert_video: {e}")
         if video_instance:
             set_video_failed(video_instance)
 
 
+def convert_video_resolution(video_id, res_label, res_height, copy=False):
+    """
+    Convert the original video to a single resolution (one rung of the fan-out).
+    """
+    video_instance = None
+    try:
+        video_instance = Video.objects.get(id=video_id)
+        if video_instance.status == "failed":
+            logger.info(f"Skipping {res_label} for failed video {video_id}")
+            return
+
+        input_file = video_instance.video_file
+        base_name, extension = get_base_name_and_extension(input_file.name)
+        output_filename = build_output_filename(base_name, res_label, extension)
+        total = len(get_resolution_plan(video_instance))
+        if is_stored_output_complete(output_filename):
+            logger.info(f"Skipping {res_label} of video {video_id}, already converted")
+        else:
+            reporter = ConversionProgressReporter(
+                video_instance, video_instance.resolutions.count(), total, res_label
+            )
+            with storage_output(output_filename) as output_path:
+                command = get_rendition_command(
+                    get_input_path(input_file.name), output_path, res_height, copy
+                )
+                run_ffmpeg_with_progress(command, video_instance.duration, reporter.report)
+            logger.info(f"Video converted and saved to {output_filename}")
+        save_resolution(video_instance, res_label, output_filename)
+        # Rungs can finish in any order, so progress is based on the finished rows
+        done = video_instance.resolutions.count()
+        update_video_progress(video_instance, done, total, res_label)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Failed to convert video to {res_label}: {e}")
+        if video_instance:
+            fail_or_retry(video_instance, e)
+    except Exception as e:
+        logger.error(f"General error in convert_video_resolution: {e}")
+        if video_instance:
+            fail_or_retry(video_instance, e)
+
+
+def finalize_video_conversion(video_id):
+    """
+    Join step of the fan-out: mark the video ready once every resolution exists.
+    """
+    video_instance = Video.objects.get(id=video_id)
+    if video_instance.status == "failed":
+        return
+    plan = get_resolution_plan(video_instance)
+    converted = set(video_instance.resolutions.values_list("resolution", flat=True))
+    missing = [label for label, _, _ in plan if label not in converted]
+    if missing:
+        logger.error(f"Video {video_id} is missing resolutions: {', '.join(missing)}")
+        set_video_failed(video_instance)
+        return
+    update_video_progress(video_instance, len(plan), len(plan), plan[-1][0])
+    # Left over by a segmented conversion
+    delete_storage_directory(get_segment_directory(video_id))
+    enqueue_packaging(video_id)
+
+
+def is_segmented_conversion(video_instance):
+    """
+    Long sources are encoded in segments across the workers, see VIDEO_SEGMENTED_MIN_DURATION.
+    """
+    min_duration = getattr(settings, "VIDEO_SEGMENTED_MIN_DURATION", None)
+    return bool(min_duration and video_instance.duration and video_instance.duration >= min_duration)
+
+
+def get_segment_directory(video_id):
+    return f"segments/{video_id}"
+
+
+def get_encoded_segment_name(video_id, res_label, segment_name):
+    return f"{get_segment_directory(video_id)}/{res_label}/{os.path.basename(segment_name)}"
+
+
+def split_video_source(video_id):
+    """
+    Split the source at keyframes, then enqueue an encode job per segment and
+    resolution, a concat job per resolution and the join job of the fan-out.
+    """
+    video_instance = None
+    try:
+        video_instance = Video.objects.get(id=video_id)
+        _, extension = get_base_name_and_extension(video_instance.video_file.name)
+        source_directory = f"{get_segment_directory(video_id)}/source"
+        # A retry starts from scratch, the split is cheap compared to encoding
+        delete_storage_directory(source_directory)
+        segment_seconds = get_segment_seconds(
+            video_instance.duration,
+            getattr(settings, "VIDEO_SEGMENT_COUNT", 8),
+            getattr(settings, "VIDEO_MIN_SEGMENT_SECONDS", 60),
+        )
+        with storage_output_directory(source_directory) as output_directory:
+            command = get_ffmpeg_segment_command(
+                get_input_path(video_instance.video_file.name),
+                os.path.join(output_directory, f"segment_%04d.{extension}"),
+                segment_seconds,
+            )
+            subprocess.run(command, check=True)
+            segment_names = [f"{source_directory}/{name}" for name in sorted(os.listdir(output_directory))]
+        enqueue_segment_jobs(video_instance, segment_names)
+        logger.info(f"Video {video_id} split into {len(segment_names)} segments")
+    except Exception as e:
+        logger.error(f"Error in split_video_source: {e}")
+        if video_instance:
+            fail_or_retry(video_instance, e)
+
+
+def enqueue_segment_jobs(video_instance, segment_names):
+    speed_factor = getattr(settings, "VIDEO_TRANSCODE_SPEED_FACTOR", 1.0)
+    segment_duration = video_instance.duration / len(segment_names)
+    join_jobs = []
+    for rung in get_resolution_plan(video_instance):
+        res_label, res_height, copy = rung
+        if copy:
+            # Copying is fast, no need to split the work
+            join_jobs.append(enqueue_transcode(
+                convert_video_resolution, None, video_instance.id, res_label, res_height, copy
+            ))
+            continue
+        segment_jobs = [
+            enqueue_transcode(
+                encode_video_segment,
+                estimate_transcode_seconds(segment_duration, [rung], speed_factor),
+                video_instance.id,
+                res_label,
+                res_height,
+                segment_name,
+            )
+            for segment_name in segment_names
+        ]
+        join_jobs.append(get_queue("transcode_short").enqueue(
+            concat_video_segments, video_instance.id, res_label, segment_names, depends_on=segment_jobs
+        ))
+    get_queue("transcode_short").enqueue(finalize_video_conversion, video_instance.id, depends_on=join_jobs)
+
+
+def encode_video_segment(video_id, res_label, res_height, segment_name):
+    """
+    Encode one segment of the source to one resolution.
+    """
+    video_instance = None
+    try:
+        video_instance = Video.objects.get(id=video_id)
+        if video_instance.status == "failed":
+            return
+        output_name = get_encoded_segment_name(video_id, res_label, segment_name)
+        if is_stored_output_complete(output_name):
+            return
+        with storage_output(output_name) as output_path:
+            command = get_rendition_command(get_input_path(segment_name), output_path, res_height)
+            run_ffmpeg_with_progress(command)
+    except Exception as e:
+        logger.error(f"Failed to encode {segment_name} to {res_label}: {e}")
+        if video_instance:
+            fail_or_retry(video_instance, e)
+
+
+def concat_video_segments(video_id, res_label, segment_names):
+    """
+    Join the encoded segments of a resolution without re-encoding and record it.
+    """
+    video_instance = None
+    try:
+        video_instance = Video.objects.get(id=video_id)
+        if video_instance.status == "failed":
+            return
+        base_name, extension = get_base_name_and_extension(video_instance.video_file.name)
+        output_filename = build_output_filename(base_name, res_label, extension)
+        if not is_stored_output_complete(output_filename):
+            with tempfile.TemporaryDirectory() as tmp:
+                list_path = os.path.join(tmp, "segments.txt")
+                with open(list_path, "w") as f:
+                    f.write(build_concat_list([
+                        get_input_path(get_encoded_segment_name(video_id, res_label, name))
+                        for name in segment_names
+                    ]))
+                with storage_output(output_filename) as output_path:
+                    run_ffmpeg_with_progress(get_ffmpeg_concat_command(list_path, output_path))
+        save_resolution(video_instance, res_label, output_filename)
+        done = video_instance.resolutions.count()
+        update_video_progress(video_instance, done, len(get_resolution_plan(video_instance)), res_label)
+        delete_storage_directory(f"{get_segment_directory(video_id)}/{res_label}")
+        logger.info(f"Segments of video {video_id} joined to {output_filename}")
+    except Exception as e:
+        logger.error(f"Failed to join the {res_label} segments of video {video_id}: {e}")
+        if video_instance:
+            fail_or_retry(video_instance, e)
+
+
+def enqueue_packaging(video_id):
+    """
+    Enqueue the HLS packaging stage once all resolutions are converted.
+    """
+    if getattr(settings, "VIDEO_HLS_ENABLED", True):
+        get_queue("packaging").enqueue(package_video_hls, video_id)
+
+
+def get_hls_directory(video_id):
+    return f"hls/{video_id}"
+
+
+def package_video_hls(video_id):
+    """
+    Package every converted resolution into HLS segments and write a master playlist.
+    The MP4 files stay untouched, a failed packaging only logs an error.
+    """
+    try:
+        video_instance = Video.objects.get(id=video_id)
+        heights = dict(RESOLUTIONS)
+        resolutions = sorted(
+            video_instance.resolutions.all(),
+            key=lambda res: heights.get(res.resolution, 0),
+        )
+        if not resolutions:
+            logger.warning(f"No resolutions to package for video {video_id}")
+            return
+
+        segment_type = getattr(settings, "VIDEO_HLS_SEGMENT_TYPE", "mpegts")
+        segment_extension = "m4s" if segment_type == "fmp4" else "ts"
+        hls_directory = get_hls_directory(video_id)
+        renditions = []
+        with storage_output_directory(hls_directory) as output_directory:
+            for res in resolutions:
+                rendition_directory = os.path.join(output_directory, res.resolution)
+                os.makedirs(rendition_directory, exist_ok=True)
+                playlist_path = os.path.join(rendition_directory, "index.m3u8")
+                command = get_ffmpeg_hls_command(
+                    get_input_path(res.converted_file.name),
+                    playlist_path,
+                    os.path.join(rendition_directory, f"segment_%04d.{segment_extension}"),
+                    segment_type=segment_type,
+                    segment_seconds=getattr(settings, "VIDEO_HLS_SEGMENT_SECONDS", 6),
+                )
+                subprocess.run(command, check=True)
+                renditions.append(
+                    (
+                        f"{res.resolution}/index.m3u8",
+                        res.resolution,
+                        _get_peak_bandwidth(rendition_directory, playlist_path),
+                    )
+                )
+
+        master_name = f"{hls_directory}/master.m3u8"
+        if default_storage.exists(master_name):
+            default_storage.delete(master_name)
+        version = 7 if segment_type == "fmp4" else 3
+        default_storage.save(
+            master_name,
+            ContentFile(build_hls_master_playlist(renditions, version).encode()),
+        )
+        video_instance.hls_playlist = master_name
+        video_instance.save(update_fields=["hls_playlist"])
+        logger.info(f"HLS playlist for video {video_id} saved to {master_name}")
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Failed to package video {video_id} as HLS: {e}")
+    except Exception as e:
+        logger.error(f"General error in package_video_hls: {e}")
+
+
+def _get_peak_bandwidth(rendition_directory, playlist_path):
+    """
+    Return the highest segment bitrate in bits/s, as required for BANDWIDTH.
+    """
+    with open(playlist_path) as f:
+        segments = parse_hls_segments(f.read())
+    peak = 0
+    for duration, uri in segments:
+        if duration > 0:
+            size = os.path.getsize(os.path.join(rendition_directory, uri))
+            peak = max(peak, int(size * 8 / duration))
+    return peak
+
+
 def set_video_failed(video_instance):
     """
     Set the video status to failed and reset conversion progress.
     """
-    video_instance.status = "failed"
-    video_instance.conversion_progress = 0
-    video_instance.save()
+    video_instance.mark_failed()
+    # post_save is skipped, so the cache is invalidated here
+    invalidate_video(video_instance.id)
+    publish_video_progress(video_instance)
 
 
 def update_video_progress(video_instance, done, total, current_res):
     """
     Update the progress and current resolution of the video.
     """
-    video_instance.conversion_progress = int((done / total) * 100)
-    video_instance.current_resolution = current_res
-    video_instance.status = "ready"
-    video_instance.save()
+    if video_instance.update_progress(int((done / total) * 100), current_res):
+        invalidate_video(video_instance.id)
+        publish_video_progress(video_instance)
+
+
+def delete_stale_uploads():
+    """
+    Delete uploads that weren't finished within VIDEO_UPLOAD_EXPIRY seconds, with
+    their part files and presigned storage objects (signals). Run periodically,
+    see the delete_stale_uploads command. Returns the number of deleted uploads.
+    """
+    expiry = timezone.now() - timedelta(seconds=getattr(settings, "VIDEO_UPLOAD_EXPIRY", 60 * 60 * 24))
+    deleted, _ = VideoUpload.objects.filter(video__isnull=True, updated_at__lt=expiry).delete()
+    logger.info(f"Deleted {deleted} stale uploads")
+    return deleted
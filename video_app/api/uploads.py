@@ -0,0 +1,70 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from django.conf import settings
+from django.core.files import File
+
+
+CHUNK_READ_SIZE = 64 * 1024
+
+
+class AssembledUploadFile(File):
+    """
+    A finished chunked upload. With temporary_file_path the file system storage
+    moves the part file into place instead of copying it.
+    """
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def get_upload_part_path(upload):
+    return os.path.join(settings.VIDEO_UPLOAD_TEMP_DIR, f"{upload.id}.part")
+
+
+def receive_upload_chunk(upload, stream, length):
+    """
+    Read `length` bytes from the request stream into a temporary file next to the part file.
+    Returns the path and the number of bytes received, which is less if the client stopped sending.
+    """
+    os.makedirs(settings.VIDEO_UPLOAD_TEMP_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=settings.VIDEO_UPLOAD_TEMP_DIR, prefix=f"{upload.id}.", suffix=".chunk")
+    received = 0
+    try:
+        with os.fdopen(fd, "wb") as chunk:
+            while received < length:
+                data = stream.read(min(CHUNK_READ_SIZE, length - received))
+                if not data:
+                    break
+                chunk.write(data)
+                received += len(data)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, received
+
+
+def append_upload_chunk(upload, chunk_path):
+    """
+    Append a received chunk to the part file at the current offset of the upload.
+    """
+    path = get_upload_part_path(upload)
+    with open(path, "ab") as part, open(chunk_path, "rb") as chunk:
+        # Drop bytes of an interrupted chunk that were never confirmed
+        part.truncate(upload.offset)
+        shutil.copyfileobj(chunk, part, CHUNK_READ_SIZE)
+
+
+def hash_upload_part(upload):
+    hasher = hashlib.sha256()
+    with open(get_upload_part_path(upload), "rb") as part:
+        for data in iter(lambda: part.read(CHUNK_READ_SIZE), b""):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+def delete_upload_part(upload):
+    path = get_upload_part_path(upload)
+    if os.path.exists(path):
+        os.remove(path)
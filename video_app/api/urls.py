@@ -1,12 +1,34 @@
 from django.urls import include, path
-from .views import VideoConversionProgressView, VideoUploadView, VideoListView, VideoDetailView, VideoClearCache
+from .views import (
+    VideoConversionProgressView,
+    VideoConversionProgressStreamView,
+    VideoConversionProgressStreamTokenView,
+    VideoUploadView,
+    VideoUploadSessionView,
+    VideoUploadChunkView,
+    VideoDirectUploadView,
+    VideoUploadCompleteView,
+    StorageObjectView,
+    VideoListView,
+    VideoDetailView,
+    VideoClearCache,
+    VideoResolutionStreamView,
+)
 
 
 urlpatterns = [
     path('upload/', VideoUploadView.as_view(), name='video-upload'),
+    path('uploads/', VideoUploadSessionView.as_view(), name='video-upload-session'),
+    path('uploads/direct/', VideoDirectUploadView.as_view(), name='video-upload-direct'),
+    path('uploads/<uuid:upload_id>/', VideoUploadChunkView.as_view(), name='video-upload-chunk'),
+    path('uploads/<uuid:upload_id>/complete/', VideoUploadCompleteView.as_view(), name='video-upload-complete'),
+    path('storage/<str:token>/', StorageObjectView.as_view(), name='storage-object'),
     path('videos/', VideoListView.as_view(), name='video-list'),
     path('videos/<int:pk>/', VideoDetailView.as_view(), name='video-list-detail'),
+    path('resolutions/<int:pk>/stream/', VideoResolutionStreamView.as_view(), name='video-resolution-stream'),
     path('conversion-progress/<int:video_id>/', VideoConversionProgressView.as_view(), name='conversion-progress'),
+    path('conversion-progress/<int:video_id>/stream/', VideoConversionProgressStreamView.as_view(), name='conversion-progress-stream'),
+    path('conversion-progress/<int:video_id>/stream-token/', VideoConversionProgressStreamTokenView.as_view(), name='conversion-progress-stream-token'),
     path('django-rq/', include('django_rq.urls')),
     path('clear-cache/', VideoClearCache.as_view(), name='video-clear-cache' ),
 ]
\ No newline at end of file
@@ -1,3 +1,5 @@
+import json
+import math
 import os
 
 
@@ -28,31 +30,34 @@ def is_valid_video_extension(extension):
     return extension and extension.lower() in ["mp4", "mov", "avi", "mkv"]
 
 
-def get_ffmpeg_thumbnail_command(input_path, output_path):
+THUMBNAIL_WIDTH = 1920
+THUMBNAIL_VARIANTS = [("small", 320), ("medium", 640), ("large", 1280)]
+THUMBNAIL_FORMATS = ["jpg", "webp"]
+
+
+def get_ffmpeg_thumbnail_command(input_path, output_path, variants=()):
     """
-    Return the ffmpeg command for creating a video thumbnail.
+    Return the ffmpeg command for creating a video thumbnail. The frame is decoded
+    once and also scaled into every (path, width) of `variants`, .webp paths are WebP.
     """
-    return [
-        "ffmpeg",
-        "-i",
-        input_path,
-        "-ss",
-        "00:00:05",
-        "-vframes",
-        "1",
-        "-q:v",
-        "2",
-        "-s",
-        "1920x1440",
-        output_path,
+    outputs = [(output_path, THUMBNAIL_WIDTH), *variants]
+    labels = "".join(f"[t{index}]" for index in range(len(outputs)))
+    graph = [f"[0:v]split={len(outputs)}{labels}"] + [
+        f"[t{index}]scale={width}:-2[o{index}]" for index, (_, width) in enumerate(outputs)
     ]
+    command = ["ffmpeg", "-ss", "00:00:05", "-i", input_path, "-filter_complex", ";".join(graph)]
+    for index, (path, _) in enumerate(outputs):
+        quality = ["-quality", "80"] if path.endswith(".webp") else ["-q:v", "2"]
+        command += ["-map", f"[o{index}]", "-frames:v", "1", *quality, path]
+    return command
 
 
-def get_ffmpeg_convert_command(input_path, output_path, height):
+def get_ffmpeg_convert_command(input_path, output_path, height, threads=None):
     """
     Return the ffmpeg command for converting a video to a given height.
+    `threads` limits the encoder threads, e.g. when several rungs run in parallel.
     """
-    return [
+    command = [
         "ffmpeg",
         "-i",
         input_path,
@@ -66,5 +71,348 @@ def get_ffmpeg_convert_command(input_path, output_path, height):
         "32",
         "-c:a",
         "copy",
+    ]
+    if threads:
+        command += ["-threads", str(threads)]
+    return command + [output_path]
+
+
+def get_ffmpeg_multi_convert_command(input_path, outputs, threads=None):
+    """
+    Return one ffmpeg command that decodes the input once and writes every output.
+    `outputs` is a list of (output_path, height) tuples, the decoded stream is split
+    and scaled per output with a filter_complex graph. A height of None copies
+    the source streams into that output instead.
+    """
+    scaled = [(index, height) for index, (_, height) in enumerate(outputs) if height]
+    command = ["ffmpeg", "-i", input_path]
+    if scaled:
+        split_labels = "".join(f"[v{index}]" for index, _ in scaled)
+        graph = [f"[0:v]split={len(scaled)}{split_labels}"]
+        graph += [f"[v{index}]scale=-2:{height}[out{index}]" for index, height in scaled]
+        command += ["-filter_complex", ";".join(graph)]
+    if threads:
+        command += ["-threads", str(threads)]
+    for index, (output_path, height) in enumerate(outputs):
+        if height is None:
+            command += ["-map", "0:v", "-map", "0:a?", "-c", "copy", output_path]
+            continue
+        command += [
+            "-map",
+            f"[out{index}]",
+            "-map",
+            "0:a?",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "ultrafast",
+            "-crf",
+            "32",
+            "-c:a",
+            "copy",
+            output_path,
+        ]
+    return command
+
+
+def is_complete_output(output_path):
+    """
+    Check if ffmpeg wrote a non-empty output file.
+    """
+    return os.path.exists(output_path) and os.path.getsize(output_path) > 0
+
+
+def get_ffmpeg_hls_command(input_path, playlist_path, segment_pattern, segment_type="mpegts", segment_seconds=6):
+    """
+    Return the ffmpeg command for packaging a converted video into HLS segments.
+    The video is already encoded, so the streams are only copied into segments.
+    segment_type "fmp4" writes CMAF segments instead of MPEG-TS.
+    """
+    command = [
+        "ffmpeg",
+        "-i",
+        input_path,
+        "-c",
+        "copy",
+        "-f",
+        "hls",
+        "-hls_time",
+        str(segment_seconds),
+        "-hls_playlist_type",
+        "vod",
+        "-hls_segment_type",
+        segment_type,
+        "-hls_segment_filename",
+        segment_pattern,
+    ]
+    if segment_type == "fmp4":
+        command += ["-hls_fmp4_init_filename", "init.mp4"]
+    return command + [playlist_path]
+
+
+def parse_hls_segments(playlist_text):
+    """
+    Return (duration, uri) for every segment of an HLS media playlist.
+    """
+    segments = []
+    duration = None
+    for line in playlist_text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXTINF:"):
+            duration = float(line[len("#EXTINF:"):].split(",")[0])
+        elif line and not line.startswith("#") and duration is not None:
+            segments.append((duration, line))
+            duration = None
+    return segments
+
+
+def build_hls_master_playlist(renditions, version=3):
+    """
+    Build an HLS master playlist.
+    `renditions` is a list of (playlist_uri, resolution_label, bandwidth) tuples.
+    """
+    lines = ["#EXTM3U", f"#EXT-X-VERSION:{version}"]
+    for playlist_uri, res_label, bandwidth in renditions:
+        lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},NAME="{res_label}"')
+        lines.append(playlist_uri)
+    return "\n".join(lines) + "\n"
+
+
+def parse_range_header(range_header, file_size):
+    """
+    Parse a single byte range from an HTTP Range header.
+    Returns (start, end) with inclusive end or None if the header can't be used,
+    raises ValueError if the range is not satisfiable.
+    Example: ("bytes=0-99", 1000) => (0, 99), ("bytes=-100", 1000) => (900, 999)
+    """
+    if not range_header or not range_header.startswith("bytes="):
+        return None
+    ranges = range_header[len("bytes="):].split(",")
+    if len(ranges) != 1:
+        return None
+    start, _, end = ranges[0].strip().partition("-")
+    if not (start + end).isdigit():
+        return None
+    if not start:
+        suffix_length = int(end)
+        if suffix_length == 0 or file_size == 0:
+            raise ValueError("Range not satisfiable.")
+        return max(file_size - suffix_length, 0), file_size - 1
+    start = int(start)
+    end = int(end) if end else file_size - 1
+    if start >= file_size or end < start:
+        raise ValueError("Range not satisfiable.")
+    return start, min(end, file_size - 1)
+
+
+def parse_content_range_header(content_range):
+    """
+    Parse the Content-Range header of an upload chunk.
+    Returns (start, end, total) with inclusive end, raises ValueError if it is malformed.
+    Example: "bytes 0-99/1000" => (0, 99, 1000)
+    """
+    unit, _, spec = (content_range or "").partition(" ")
+    byte_range, _, total = spec.partition("/")
+    start, _, end = byte_range.partition("-")
+    if unit != "bytes" or not (start.isdigit() and end.isdigit() and total.isdigit()):
+        raise ValueError("Invalid Content-Range header.")
+    start, end, total = int(start), int(end), int(total)
+    if end < start or end >= total:
+        raise ValueError("Invalid Content-Range header.")
+    return start, end, total
+
+
+def parse_content_length(content_length):
+    """
+    Parse the Content-Length of a request, a missing header counts as 0.
+    Raises ValueError if it isn't a number.
+    """
+    content_length = (content_length or "0").strip()
+    if not content_length.isdigit():
+        raise ValueError("Invalid Content-Length header.")
+    return int(content_length)
+
+
+def iterate_file_range(file, start, length, chunk_size=64 * 1024):
+    """
+    Yield `length` bytes of an open file starting at `start`, then close the file.
+    """
+    try:
+        file.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def get_ffprobe_command(input_path):
+    """
+    Return the ffprobe command that prints duration, size, codec and bitrate as JSON.
+    """
+    return [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-show_entries",
+        "stream=codec_name,width,height,bit_rate:format=duration,bit_rate",
+        "-of",
+        "json",
+        input_path,
+    ]
+
+
+def parse_ffprobe_output(output):
+    """
+    Return the source metadata from the JSON output of get_ffprobe_command.
+    Unknown values are None.
+    """
+    data = json.loads(output)
+    stream = (data.get("streams") or [{}])[0]
+    format_info = data.get("format") or {}
+
+    def to_number(value, number_type):
+        try:
+            return number_type(value)
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        "duration": to_number(format_info.get("duration"), float),
+        "width": to_number(stream.get("width"), int),
+        "height": to_number(stream.get("height"), int),
+        "video_codec": stream.get("codec_name"),
+        "bitrate": to_number(format_info.get("bit_rate") or stream.get("bit_rate"), int),
+    }
+
+
+def plan_resolutions(resolutions, source_height, source_codec):
+    """
+    Return (label, height, copy) for every resolution worth producing.
+    Resolutions above the source are skipped, a resolution that matches an
+    H.264 source is copied instead of transcoded. With an unknown source
+    every resolution is transcoded.
+    Example: (RESOLUTIONS, 720, "h264") => [("120p", 120, False), ("360p", 360, False), ("720p", 720, True)]
+    """
+    if not source_height:
+        return [(label, height, False) for label, height in resolutions]
+    plan = [
+        (label, height, height == source_height and source_codec == "h264")
+        for label, height in resolutions
+        if height <= source_height
+    ]
+    if not plan:
+        # Smaller than every rung, keep the lowest one so the video is playable
+        label, height = resolutions[0]
+        plan = [(label, height, False)]
+    return plan
+
+
+def estimate_transcode_seconds(duration, plan, speed_factor=1.0):
+    """
+    Rough worker time of a conversion plan in seconds: the source duration times
+    the pixel count of every transcoded rung relative to 1080p. Copied rungs are
+    left out, returns None if the duration is unknown.
+    Example: (600, [("360p", 360, False), ("1080p", 1080, False)]) => 666.67
+    """
+    if not duration:
+        return None
+    return sum(
+        duration * speed_factor * (height / 1080) ** 2
+        for _, height, copy in plan
+        if not copy
+    )
+
+
+def get_segment_seconds(duration, segment_count, minimum_seconds=60):
+    """
+    Segment length for splitting a source into about `segment_count` parts.
+    Example: (3600, 8, 60) => 450
+    """
+    return max(minimum_seconds, math.ceil(duration / max(segment_count, 1)))
+
+
+def get_ffmpeg_segment_command(input_path, segment_pattern, segment_seconds):
+    """
+    Return the ffmpeg command for splitting a source into segments without re-encoding.
+    The segment muxer cuts at the first keyframe after every `segment_seconds`.
+    """
+    return [
+        "ffmpeg",
+        "-i",
+        input_path,
+        "-map",
+        "0:v:0",
+        "-map",
+        "0:a?",
+        "-c",
+        "copy",
+        "-f",
+        "segment",
+        "-segment_time",
+        str(segment_seconds),
+        "-reset_timestamps",
+        "1",
+        segment_pattern,
+    ]
+
+
+def build_concat_list(paths):
+    """
+    Build the input file of ffmpeg's concat demuxer, one quoted path per line.
+    Example: ["a.mp4", "b.mp4"] => "file 'a.mp4'\\nfile 'b.mp4'\\n"
+    """
+    return "".join("file '{}'\n".format(path.replace("'", "'\\''")) for path in paths)
+
+
+def get_ffmpeg_concat_command(list_path, output_path):
+    """
+    Return the ffmpeg command for joining encoded segments losslessly.
+    The list may contain URLs of a remote storage.
+    """
+    return [
+        "ffmpeg",
+        "-f",
+        "concat",
+        "-safe",
+        "0",
+        "-protocol_whitelist",
+        "file,http,https,tcp,tls",
+        "-i",
+        list_path,
+        "-c",
+        "copy",
         output_path,
     ]
+
+
+def get_ffmpeg_copy_command(input_path, output_path):
+    """
+    Return the ffmpeg command for copying the streams without transcoding.
+    """
+    return ["ffmpeg", "-i", input_path, "-c", "copy", output_path]
+
+
+def add_ffmpeg_progress_output(command):
+    """
+    Let ffmpeg write machine readable progress (key=value lines) to stdout.
+    """
+    return [command[0], "-progress", "pipe:1", "-nostats"] + command[1:]
+
+
+def parse_ffmpeg_progress_seconds(line):
+    """
+    Return the encoded position in seconds from an ffmpeg -progress line.
+    Example: "out_time_us=1500000" => 1.5, other lines => None
+    """
+    key, _, value = line.strip().partition("=")
+    # out_time_ms is also given in microseconds by ffmpeg
+    if key in ("out_time_us", "out_time_ms") and value.isdigit():
+        return int(value) / 1_000_000
+    return None
@@ -1,20 +1,145 @@
+import json
+import mimetypes
+import os
+import tempfile
+from urllib.parse import quote
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, urlencode
+from django.utils import timezone
+from django.views import View
 from rest_framework import views, status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.utils.urls import replace_query_param
 
-from video_app.models import Video
-from .serializers import VideoSerializer
+from video_app.models import Video, VideoResolution, VideoUpload
+from .serializers import VideoSerializer, VideoUploadSessionSerializer
+from .utils import parse_content_length, parse_content_range_header, parse_range_header, iterate_file_range
+from .storage import get_local_path, get_presigned_download_url, get_presigned_upload_url, load_presigned_token
+from .uploads import (
+    AssembledUploadFile,
+    append_upload_chunk,
+    delete_upload_part,
+    get_upload_part_path,
+    hash_upload_part,
+    receive_upload_chunk,
+)
+from .upload_handlers import HashingMemoryFileUploadHandler, HashingTemporaryFileUploadHandler
+from .pagination import VIDEO_FILTER_FIELDS, get_page_size, paginate_videos
+from .progress import (
+    format_sse,
+    get_async_redis,
+    get_progress_channel,
+    get_progress_payload,
+    get_progress_state,
+    get_stream_token,
+    is_final_progress,
+    load_stream_token,
+)
+from .cache import (
+    CACHE_TIMEOUT,
+    clear_catalogue_cache,
+    get_or_rebuild,
+    get_page_cache_key,
+    get_video_cache_key,
+)
 from django.core.cache import cache
 from rest_framework.parsers import MultiPartParser, FormParser
 
 
+def get_video_queryset():
+    """
+    Return videos with only the columns the serializer needs and their
+    resolutions prefetched, so serializing costs two queries for any number of rows.
+    """
+    video_fields = [
+        field.name
+        for field in Video._meta.concrete_fields
+        if field.name in VideoSerializer.Meta.fields
+    ]
+    resolutions = VideoResolution.objects.only(
+        "id", "original_video_id", "resolution", "converted_file"
+    )
+    # Duplicate uploads show the media of their original
+    original_fields = [f"duplicate_of__{field}" for field in video_fields]
+    return (
+        Video.objects.select_related("duplicate_of")
+        .only(*video_fields, "duplicate_of", *original_fields)
+        .prefetch_related(
+            Prefetch("resolutions", queryset=resolutions),
+            Prefetch("duplicate_of__resolutions", queryset=resolutions),
+        )
+    )
+
+
+def save_uploaded_video(serializer, content_hash):
+    """
+    Save a validated upload. A source that was uploaded before isn't stored and
+    converted again, the new video points to the original and reuses its files.
+    A failed original isn't reused, the new upload is converted and takes over the hash.
+    """
+    original = None
+    if content_hash:
+        original = Video.objects.filter(content_hash=content_hash).first()
+        if original is not None and original.status == "failed":
+            # content_hash is unique, the failed video releases it for the new upload
+            Video.objects.filter(pk=original.pk, status="failed").update(content_hash=None)
+            original = None
+    if original is None:
+        try:
+            with transaction.atomic():
+                return serializer.save(content_hash=content_hash)
+        except IntegrityError:
+            # The same file was uploaded concurrently
+            original = Video.objects.get(content_hash=content_hash)
+    # The duplicate starts with the files and the conversion state of the original,
+    # update_progress() and mark_failed() keep the state in sync from then on
+    return serializer.save(duplicate_of=original, **original.get_media_values())
+
+
+def get_serialized_videos(pks):
+    """
+    Return the serialized videos in the order of `pks`.
+    Cached entries are read in one round trip, only the missing ones are queried.
+    """
+    cache_keys = {pk: get_video_cache_key(pk) for pk in pks}
+    cached = cache.get_many(cache_keys.values())
+    missing = [pk for pk in pks if cache_keys[pk] not in cached]
+    if missing:
+        fresh = {
+            get_video_cache_key(video.pk): VideoSerializer(video).data
+            for video in get_video_queryset().filter(pk__in=missing)
+        }
+        cache.set_many(fresh, timeout=CACHE_TIMEOUT)
+        cached.update(fresh)
+    return [cached[cache_keys[pk]] for pk in pks if cache_keys[pk] in cached]
+
+
 class VideoClearCache(views.APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        cache_key = "all_videos"
-        cache.delete(cache_key)
+        clear_catalogue_cache()
         return Response({"status": "Cache cleared"}, status=status.HTTP_200_OK)
 
 
@@ -22,21 +147,268 @@ class VideoUploadView(views.APIView):
     permission_classes = [IsAuthenticated]
     parser_classes = (MultiPartParser, FormParser)
 
+    def initial(self, request, *args, **kwargs):
+        request._request.upload_handlers = [
+            HashingMemoryFileUploadHandler(request._request),
+            HashingTemporaryFileUploadHandler(request._request),
+        ]
+        super().initial(request, *args, **kwargs)
+
     def post(self, request):
-        cache_key = "all_videos"
         serializer = VideoSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
-            cache.delete(cache_key)
+            video_file = serializer.validated_data.get("video_file")
+            save_uploaded_video(serializer, getattr(video_file, "content_hash", None))
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class VideoUploadSessionView(views.APIView):
+    """
+    Start a resumable upload. The file is then sent in chunks with
+    PUT uploads/<id>/ and a Content-Range header.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = VideoUploadSessionSerializer(data=request.data)
+        if serializer.is_valid():
+            serializer.save(user=request.user)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class VideoUploadChunkView(views.APIView):
+    """
+    GET/HEAD report the offset to resume from, PUT appends the chunk starting at
+    that offset. The Video is only created, and converted, after the last chunk.
+    A PUT without body finishes a complete upload, e.g. after a failed completion.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, upload_id):
+        upload = get_object_or_404(VideoUpload, pk=upload_id, user=request.user)
+        return self.upload_response(upload)
+
+    def put(self, request, upload_id):
+        try:
+            content_length = parse_content_length(request.META.get("CONTENT_LENGTH"))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if "Content-Range" not in request.headers and not content_length:
+            # A PUT without a chunk only finishes an upload whose bytes all arrived
+            return self.finish_upload(request, upload_id)
+        try:
+            start, end, total = parse_content_range_header(request.headers.get("Content-Range"))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        length = end - start + 1
+        if content_length != length:
+            return Response(
+                {"detail": "Content-Length doesn't match Content-Range."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        upload = get_object_or_404(VideoUpload, pk=upload_id, user=request.user)
+        if upload.storage_name or total != upload.size:
+            return self.upload_response(upload, status.HTTP_409_CONFLICT)
+        # A retried last chunk of a complete upload only finishes it
+        if not upload.is_complete:
+            if start != upload.offset:
+                return self.upload_response(upload, status.HTTP_409_CONFLICT)
+            # The body is read without a row lock, a slow client doesn't block the upload
+            chunk_path, written = receive_upload_chunk(upload, request.stream, length)
+            try:
+                with transaction.atomic():
+                    upload = get_object_or_404(
+                        VideoUpload.objects.select_for_update(), pk=upload_id, user=request.user
+                    )
+                    # A concurrent PUT stored this range in the meantime
+                    if start != upload.offset:
+                        return self.upload_response(upload, status.HTTP_409_CONFLICT)
+                    append_upload_chunk(upload, chunk_path)
+                    upload.offset += written
+                    VideoUpload.objects.filter(pk=upload.pk).update(offset=upload.offset, updated_at=timezone.now())
+            finally:
+                os.remove(chunk_path)
+            if written < length:
+                return self.upload_response(upload, status.HTTP_400_BAD_REQUEST)
+        if not upload.is_complete:
+            return self.upload_response(upload)
+        return self.finish_upload(request, upload_id)
+
+    def delete(self, request, upload_id):
+        upload = get_object_or_404(VideoUpload, pk=upload_id, user=request.user)
+        upload.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def upload_response(self, upload, status_code=status.HTTP_200_OK):
+        response = Response(VideoUploadSessionSerializer(upload).data, status=status_code)
+        response["Upload-Offset"] = upload.offset
+        return response
+
+    def finish_upload(self, request, upload_id):
+        """
+        Create the Video of a complete upload, or return it if it exists already.
+        Can be retried if the completion failed after the last chunk was stored.
+        """
+        with transaction.atomic():
+            upload = get_object_or_404(
+                VideoUpload.objects.select_for_update(), pk=upload_id, user=request.user
+            )
+            if upload.video_id:
+                response = Response(VideoSerializer(upload.video).data, status=status.HTTP_200_OK)
+            elif upload.storage_name or not upload.is_complete:
+                return self.upload_response(upload, status.HTTP_409_CONFLICT)
+            else:
+                video = self.complete_upload(upload)
+                response = Response(VideoSerializer(video).data, status=status.HTTP_201_CREATED)
+        # A duplicate doesn't take over the part file
+        delete_upload_part(upload)
+        return response
+
+    def complete_upload(self, upload):
+        """
+        Create the Video from the assembled part file. The content hash is taken
+        here in one pass, chunks of earlier requests can't be hashed as they arrive.
+        """
+        content_hash = hash_upload_part(upload)
+        with open(get_upload_part_path(upload), "rb") as part:
+            serializer = VideoSerializer(data={
+                "title": upload.title,
+                "description": upload.description,
+                "genre": upload.genre,
+                "category": upload.category,
+                "video_file": AssembledUploadFile(part, name=upload.filename),
+            })
+            serializer.is_valid(raise_exception=True)
+            video = save_uploaded_video(serializer, content_hash)
+        VideoUpload.objects.filter(pk=upload.pk).update(video=video)
+        return video
+
+
+class VideoDirectUploadView(views.APIView):
+    """
+    Start an upload straight to the storage. The client PUTs the file to
+    `upload_url` and then calls uploads/<id>/complete/.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = VideoUploadSessionSerializer(data=request.data)
+        if serializer.is_valid():
+            upload = serializer.save(user=request.user)
+            upload.storage_name = default_storage.get_available_name(
+                default_storage.generate_filename(f"videos/{upload.id.hex}_{upload.filename}"),
+                max_length=Video._meta.get_field("video_file").max_length,
+            )
+            upload.save(update_fields=["storage_name"])
+            data = VideoUploadSessionSerializer(upload).data
+            data["upload_url"] = request.build_absolute_uri(
+                get_presigned_upload_url(upload.storage_name, upload.size)
+            )
+            return Response(data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class VideoUploadCompleteView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, upload_id):
+        with transaction.atomic():
+            upload = get_object_or_404(
+                VideoUpload.objects.select_for_update(), pk=upload_id, user=request.user, storage_name__isnull=False
+            )
+            if upload.video_id:
+                return Response(VideoSerializer(upload.video).data, status=status.HTTP_200_OK)
+            name = upload.storage_name
+            if not default_storage.exists(name) or default_storage.size(name) != upload.size:
+                return Response(
+                    {"detail": "The file wasn't uploaded completely."}, status=status.HTTP_409_CONFLICT
+                )
+            # The file is already stored, the Video just points to it
+            video = Video.objects.create(
+                title=upload.title,
+                description=upload.description,
+                genre=upload.genre,
+                category=upload.category,
+                video_file=name,
+            )
+            upload.offset = upload.size
+            upload.video = video
+            upload.save(update_fields=["offset", "video", "updated_at"])
+        return Response(VideoSerializer(video).data, status=status.HTTP_201_CREATED)
+
+
+class StorageObjectView(views.APIView):
+    """
+    Stand-in for presigned object storage URLs on the file system storage,
+    the signed token in the URL is the only authorization.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, token):
+        try:
+            name = load_presigned_token(token, "GET")["name"]
+        except signing.BadSignature:
+            return Response({"detail": "Invalid or expired URL."}, status=status.HTTP_403_FORBIDDEN)
+        if not default_storage.exists(name):
+            raise Http404
+        return FileResponse(default_storage.open(name, "rb"))
+
+    def put(self, request, token):
+        try:
+            data = load_presigned_token(token, "PUT")
+        except signing.BadSignature:
+            return Response({"detail": "Invalid or expired URL."}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            content_length = parse_content_length(request.META.get("CONTENT_LENGTH"))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        max_size = data.get("size") or settings.VIDEO_UPLOAD_MAX_SIZE
+        if max_size and content_length > max_size:
+            return Response({"detail": "The file is too large."}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        # The URL stays valid after completion, the file of a created video can't be replaced
+        uploaded = VideoUpload.objects.filter(storage_name=data["name"], video__isnull=False)
+        if uploaded.exists():
+            return Response({"detail": "The upload is already completed."}, status=status.HTTP_409_CONFLICT)
+        path = get_local_path(data["name"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under a temporary name and renamed at the end, the stored file is never half written
+        fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".partial")
+        written = 0
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in iter(lambda: request.stream.read(64 * 1024), b""):
+                    written += len(chunk)
+                    # Content-Length can be missing or wrong, the bytes themselves are counted
+                    if max_size and written > max_size:
+                        break
+                    f.write(chunk)
+            if max_size and written > max_size:
+                return Response({"detail": "The file is too large."}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            if uploaded.exists():
+                return Response({"detail": "The upload is already completed."}, status=status.HTTP_409_CONFLICT)
+            os.replace(partial_path, path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return Response(status=status.HTTP_200_OK)
+
+
 class VideoConversionProgressView(views.APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, video_id):
-        video = get_object_or_404(Video, id=video_id)
+        video = get_object_or_404(
+            Video.objects.only("duplicate_of", "conversion_progress", "current_resolution"), id=video_id
+        )
+        # Live progress of a running conversion is only kept in Redis,
+        # a duplicate upload shows the conversion of its original
+        state = get_progress_state(video.duplicate_of_id or video.id)
+        if state is not None:
+            return Response(
+                {"progress": state["progress"], "current_resolution": state["current_resolution"]}
+            )
         return Response(
             {
                 "progress": video.conversion_progress,
@@ -45,28 +417,150 @@ class VideoConversionProgressView(views.APIView):
         )
 
 
+class VideoConversionProgressStreamTokenView(views.APIView):
+    """
+    Issue the URL of a progress stream with a short-lived signed token, for
+    EventSource clients that can't send the Authorization header.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, video_id):
+        get_object_or_404(Video.objects.only("id"), id=video_id)
+        token = get_stream_token(request.user.pk, video_id)
+        stream_url = reverse("conversion-progress-stream", args=[video_id])
+        return Response(
+            {"token": token, "stream_url": request.build_absolute_uri(f"{stream_url}?{urlencode({'token': token})}")},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+@sync_to_async
+def authenticate_stream_request(request, video_id):
+    """
+    Authenticate with a stream token from ?token= (see VideoConversionProgressStreamTokenView)
+    or with the configured DRF authentication classes.
+    """
+    token = request.GET.get("token")
+    if token:
+        try:
+            user_id = load_stream_token(token, video_id)
+        except signing.BadSignature:
+            return None
+        return get_user_model().objects.filter(pk=user_id, is_active=True).first()
+    drf_request = Request(request)
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authentication_class().authenticate(drf_request)
+        except AuthenticationFailed:
+            return None
+        if result is not None:
+            return result[0]
+    return None
+
+
+class VideoConversionProgressStreamView(View):
+    """
+    Push conversion progress as Server-Sent Events instead of being polled.
+    Needs an ASGI server (uvicorn core.asgi:application), so a waiting client doesn't
+    hold a worker thread. Browsers open it with the stream_url of stream-token/.
+    """
+    heartbeat_seconds = 15
+
+    async def get(self, request, video_id):
+        user = await authenticate_stream_request(request, video_id)
+        if user is None:
+            return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+        video = await Video.objects.filter(pk=video_id).values("duplicate_of").afirst()
+        if video is None:
+            return JsonResponse({"detail": "Not found."}, status=404)
+        # A duplicate upload follows the conversion of its original
+        response = StreamingHttpResponse(
+            self.events(video_id, video["duplicate_of"] or video_id), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    async def events(self, video_id, source_id):
+        client = get_async_redis()
+        pubsub = client.pubsub()
+        # Subscribe before reading the snapshot, so no update gets lost in between
+        await pubsub.subscribe(get_progress_channel(source_id))
+        try:
+            video = await Video.objects.filter(pk=source_id).values(
+                "status", "conversion_progress", "current_resolution"
+            ).afirst()
+            if video is None:
+                return
+            payload = get_progress_payload(
+                video_id, video["status"], video["conversion_progress"], video["current_resolution"]
+            )
+            yield format_sse(payload)
+            while not is_final_progress(payload):
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=self.heartbeat_seconds
+                )
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                payload = json.loads(message["data"])
+                payload["video_id"] = video_id
+                yield format_sse(payload)
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+            await client.aclose()
+
+
 class VideoListView(views.APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        cache_key = "all_videos"
-        cached_videos = cache.get(cache_key)
-        if cached_videos is not None:
-            return Response(cached_videos)
-        videos = Video.objects.all().order_by('-uploaded_at')
-        serializer = VideoSerializer(videos, many=True)
-        serialized_data = serializer.data
-        cache.set(cache_key, serialized_data, timeout=300)
-        return Response(serialized_data)
+        filters = {
+            field: request.query_params[field]
+            for field in VIDEO_FILTER_FIELDS
+            if request.query_params.get(field)
+        }
+        cursor = request.query_params.get("cursor")
+        page_size = get_page_size(
+            request.query_params.get("page_size"),
+            settings.VIDEO_PAGE_SIZE,
+            settings.VIDEO_MAX_PAGE_SIZE,
+        )
+
+        def build_page():
+            videos, next_cursor = paginate_videos(
+                Video.objects.filter(**filters).only("id", "uploaded_at"),
+                cursor,
+                page_size,
+            )
+            return {"ids": [video.pk for video in videos], "next_cursor": next_cursor}
+
+        # Pages only store ids, the videos themselves come from their own entries
+        try:
+            page = get_or_rebuild(get_page_cache_key(filters, cursor, page_size), build_page)
+        except ValueError:
+            return Response({"cursor": "Invalid cursor."}, status=status.HTTP_400_BAD_REQUEST)
+
+        next_cursor = page["next_cursor"]
+        return Response(
+            {
+                "next": replace_query_param(request.get_full_path(), "cursor", next_cursor)
+                if next_cursor
+                else None,
+                "results": get_serialized_videos(page["ids"]),
+            }
+        )
 
 
 class VideoDetailView(views.APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, pk):
-        video = get_object_or_404(Video, pk=pk)
-        serializer = VideoSerializer(video)
-        return Response(serializer.data)
+        videos = get_serialized_videos([pk])
+        if not videos:
+            raise Http404
+        return Response(videos[0])
 
     def patch(self, request, pk):
         video = get_object_or_404(Video, pk=pk)
@@ -74,11 +568,87 @@ class VideoDetailView(views.APIView):
         serializer = VideoSerializer(video, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
-            cache.delete("all_videos")
-            cache.set(
-                "all_videos",
-                VideoSerializer(Video.objects.all(), many=True).data,
-                timeout=300,
-            )
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class VideoResolutionStreamView(views.APIView):
+    """
+    Serve a converted resolution with HTTP Range support.
+    With VIDEO_STREAM_SENDFILE set, the byte transfer is handed to the front proxy.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        resolution = get_object_or_404(VideoResolution, pk=pk)
+        name = resolution.converted_file.name
+        if not name or not default_storage.exists(name):
+            return Response({"detail": "File not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        path = get_local_path(name)
+        if path is None:
+            # Remote storage serves ranges itself
+            return HttpResponseRedirect(get_presigned_download_url(name))
+        stat = os.stat(path)
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        last_modified = int(stat.st_mtime)
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        sendfile_mode = getattr(settings, "VIDEO_STREAM_SENDFILE", None)
+        if sendfile_mode:
+            response = self.get_sendfile_response(sendfile_mode, name, path, content_type)
+        else:
+            response = self.get_file_response(request, path, stat.st_size, etag, last_modified, content_type)
+        response["Accept-Ranges"] = "bytes"
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        return response
+
+    def get_sendfile_response(self, sendfile_mode, name, path, content_type):
+        response = HttpResponse(content_type=content_type)
+        if sendfile_mode == "x-accel-redirect":
+            prefix = getattr(settings, "VIDEO_STREAM_ACCEL_PREFIX", "/protected-media/")
+            # nginx decodes the URI, names with spaces, "#", "?" or non-ASCII characters must be quoted
+            response["X-Accel-Redirect"] = f"{prefix.rstrip('/')}/{quote(name)}"
+        else:
+            response["X-Sendfile"] = path
+        return response
+
+    def get_file_response(self, request, path, size, etag, last_modified, content_type):
+        byte_range = None
+        if self.range_applies(request, etag, last_modified):
+            try:
+                byte_range = parse_range_header(request.META.get("HTTP_RANGE"), size)
+            except ValueError:
+                response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response["Content-Range"] = f"bytes */{size}"
+                return response
+
+        if byte_range is None:
+            # FileResponse uses wsgi.file_wrapper, so the server can use sendfile
+            return FileResponse(open(path, "rb"), content_type=content_type)
+
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            iterate_file_range(open(path, "rb"), start, length),
+            status=status.HTTP_206_PARTIAL_CONTENT,
+            content_type=content_type,
+        )
+        response["Content-Length"] = str(length)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        return response
+
+    def range_applies(self, request, etag, last_modified):
+        """
+        A Range is only used if an If-Range validator still matches the file.
+        """
+        if_range = request.META.get("HTTP_IF_RANGE")
+        if not if_range:
+            return True
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            return if_range == etag
+        return parse_http_date_safe(if_range) == last_modified
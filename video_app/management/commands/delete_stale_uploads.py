@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from video_app.api.tasks import delete_stale_uploads
+from core.queues import get_queue
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete uploads that weren't finished within VIDEO_UPLOAD_EXPIRY. Meant to run "
+        "periodically, e.g. hourly from cron: python manage.py delete_stale_uploads --enqueue"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--enqueue", action="store_true", help="Run the cleanup as a job on the RQ queue.")
+
+    def handle(self, *args, **options):
+        if options["enqueue"]:
+            job = get_queue("maintenance").enqueue(delete_stale_uploads)
+            self.stdout.write(f"Enqueued stale upload cleanup job {job.id}")
+            return
+        deleted = delete_stale_uploads()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} stale uploads"))
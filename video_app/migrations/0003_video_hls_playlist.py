@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_app', '0002_video_status_alter_video_uploaded_at_videoprogress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='hls_playlist',
+            field=models.FileField(blank=True, max_length=500, null=True, upload_to='hls'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_app', '0006_video_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videoupload',
+            name='storage_name',
+            field=models.CharField(blank=True, max_length=500, null=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-18 19:46
+
+from django.db import migrations, models
+
+
+def delete_duplicate_resolutions(apps, schema_editor):
+    """
+    Keep the newest row of every (original_video, resolution) pair, older
+    conversions could add a second row for the same resolution.
+    """
+    VideoResolution = apps.get_model('video_app', 'VideoResolution')
+    duplicates = (
+        VideoResolution.objects.filter(original_video__isnull=False)
+        .values('original_video', 'resolution')
+        .annotate(keep_id=models.Max('id'), count=models.Count('id'))
+        .filter(count__gt=1)
+    )
+    for row in duplicates:
+        VideoResolution.objects.filter(
+            original_video=row['original_video'], resolution=row['resolution']
+        ).exclude(id=row['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_app', '0007_videoupload_storage_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_resolutions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='videoresolution',
+            constraint=models.UniqueConstraint(fields=('original_video', 'resolution'), name='unique_video_resolution'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_app', '0008_unique_video_resolution'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='thumbnail_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
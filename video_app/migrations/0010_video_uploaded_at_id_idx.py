@@ -0,0 +1,17 @@
+# Generated by Django 5.2.1 on 2026-10-18 21:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('video_app', '0009_video_thumbnail_variants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='video',
+            index=models.Index(fields=['-uploaded_at', '-id'], name='video_uploaded_at_id_idx'),
+        ),
+    ]
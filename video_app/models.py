@@ -1,5 +1,7 @@
+import uuid
 from datetime import date
 from django.db import models
+from django.db.models.fields.files import FieldFile
 from django.conf import settings
 
 class Video(models.Model):
@@ -32,19 +34,158 @@ class Video(models.Model):
     category = models.CharField(max_length=100, choices=CATEGORY_CHOICES, default=CATEGORY_CHOICES[0][0])
     video_file = models.FileField(upload_to='videos', blank=True, null=True)
     thumbnail = models.ImageField(upload_to='thumbnails/', blank=True, null=True)
+    # Smaller thumbnails for grids, e.g. {"small": {"jpg": "thumbnails/...", "webp": "thumbnails/..."}}
+    thumbnail_variants = models.JSONField(default=dict, blank=True)
     conversion_progress = models.IntegerField(default=0)
     current_resolution = models.CharField(max_length=10, blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='processing')
+    hls_playlist = models.FileField(upload_to='hls', max_length=500, blank=True, null=True)
+    duration = models.FloatField(blank=True, null=True)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    video_codec = models.CharField(max_length=50, blank=True, null=True)
+    bitrate = models.PositiveBigIntegerField(blank=True, null=True)
+    content_hash = models.CharField(max_length=64, unique=True, blank=True, null=True, editable=False)
+    duplicate_of = models.ForeignKey(
+        'self', related_name='duplicates', on_delete=models.SET_NULL, blank=True, null=True, editable=False
+    )
+
+    # Fields a duplicate upload takes from the video it duplicates
+    MEDIA_FIELDS = [
+        'video_file', 'thumbnail', 'thumbnail_variants', 'hls_playlist', 'conversion_progress',
+        'current_resolution', 'status', 'duration', 'width', 'height', 'video_codec', 'bitrate',
+    ]
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the video list, see paginate_videos()
+            models.Index(fields=['-uploaded_at', '-id'], name='video_uploaded_at_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
+
+    def update_progress(self, progress, current_resolution):
+        """
+        Write the conversion progress as one UPDATE of the changed columns, without
+        save() and its signals. The progress never goes back and a failed video stays
+        failed, so rungs finishing out of order can't overwrite each other.
+        Returns True if the row was updated.
+        """
+        # Duplicate uploads aren't converted, they mirror the state of their original
+        updated = (
+            Video.objects.filter(models.Q(pk=self.pk) | models.Q(duplicate_of=self.pk))
+            .filter(conversion_progress__lte=progress)
+            .exclude(status="failed")
+            .update(conversion_progress=progress, current_resolution=current_resolution, status="ready")
+        )
+        if updated:
+            self.conversion_progress = progress
+            self.current_resolution = current_resolution
+            self.status = "ready"
+        return bool(updated)
+
+    def get_media_values(self):
+        """
+        The MEDIA_FIELDS as plain values, file fields by name, e.g. for saving a duplicate.
+        """
+        values = {}
+        for field in self.MEDIA_FIELDS:
+            value = getattr(self, field)
+            values[field] = value.name if isinstance(value, FieldFile) else value
+        return values
+
+    @property
+    def media_source(self):
+        """
+        The video that owns the files, for a duplicate upload that's the original.
+        """
+        return self.duplicate_of or self
+
+    def delete(self, *args, **kwargs):
+        self.promote_duplicate()
+        return super().delete(*args, **kwargs)
+
+    def promote_duplicate(self):
+        """
+        Hand files, resolutions and content hash over to the oldest duplicate
+        before this video is deleted. Returns the promoted video or None.
+        """
+        successor = self.duplicates.order_by('id').first()
+        if successor is None:
+            return None
+        self.duplicates.exclude(pk=successor.pk).update(duplicate_of=successor)
+        self.resolutions.update(original_video=successor)
+        # content_hash is unique, so it's released before the successor takes it
+        Video.objects.filter(pk=self.pk).update(content_hash=None)
+        successor.content_hash, self.content_hash = self.content_hash, None
+        successor.duplicate_of = None
+        for field in self.MEDIA_FIELDS:
+            setattr(successor, field, getattr(self, field))
+        successor.save(update_fields=['content_hash', 'duplicate_of', *self.MEDIA_FIELDS])
+        # The files belong to the successor now and must survive this delete
+        for field in ['video_file', 'thumbnail', 'hls_playlist']:
+            setattr(self, field, None)
+        self.thumbnail_variants = {}
+        return successor
+
+    def set_thumbnails(self, thumbnail, variants):
+        """
+        Store the thumbnail names with one UPDATE, the files are already in the storage.
+        """
+        Video.objects.filter(pk=self.pk).update(thumbnail=thumbnail, thumbnail_variants=variants)
+        self.thumbnail = thumbnail
+        self.thumbnail_variants = variants
+
+    def mark_failed(self):
+        """
+        Set the status to failed and reset the progress with one UPDATE, without signals.
+        """
+        Video.objects.filter(models.Q(pk=self.pk) | models.Q(duplicate_of=self.pk)).update(
+            status="failed", conversion_progress=0
+        )
+        self.status = "failed"
+        self.conversion_progress = 0
     
 
+class VideoUpload(models.Model):
+    """
+    A resumable upload session, the file is sent in chunks and the Video is
+    created once all bytes arrived.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='video_uploads', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    title = models.CharField(max_length=150)
+    description = models.CharField(max_length=500)
+    genre = models.CharField(max_length=100, choices=Video.GENRE_CHOICES, default=Video.GENRE_CHOICES[0][0])
+    category = models.CharField(max_length=100, choices=Video.CATEGORY_CHOICES, default=Video.CATEGORY_CHOICES[0][0])
+    # Set for uploads that go straight to the storage through a presigned URL
+    storage_name = models.CharField(max_length=500, blank=True, null=True)
+    video = models.OneToOneField(Video, related_name='upload', on_delete=models.SET_NULL, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+    @property
+    def is_complete(self):
+        return self.offset >= self.size
+
+
 class VideoResolution(models.Model):
     original_video = models.ForeignKey(Video, related_name='resolutions', on_delete=models.CASCADE, null=True)
     resolution = models.CharField(max_length=20)
     converted_file = models.FileField(upload_to='videos', max_length=500)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['original_video', 'resolution'], name='unique_video_resolution'),
+        ]
+
     def __str__(self):
         return f"{self.original_video.title} - {self.resolution}"
     
@@ -1,14 +1,35 @@
+from django.conf import settings
 from django.core.cache import cache
+from django.db import connection
+from django.db.models.signals import post_save
+from django.test.utils import CaptureQueriesContext
+from asgiref.sync import async_to_sync
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
-from video_app.models import Video, VideoResolution, VideoProgress
-from accounts_app.models import CustomUser
-from rest_framework.authtoken.models import Token
+from video_app.models import Video, VideoResolution, VideoProgress, VideoUpload
+from accounts_app.models import AuthToken, CustomUser
 from django.core.files.uploadedfile import SimpleUploadedFile
 from unittest.mock import mock_open, patch, MagicMock
+import json
+import os
+import subprocess
+import tempfile
+import time
+from datetime import timedelta
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from core.queues import get_queue_name
 from video_app.api.tasks import convert_video
-from video_app.api import tasks, utils
+from video_app.api import tasks, utils, views
+from video_app.api.pagination import encode_cursor, paginate_videos
+from video_app.api.cache import get_or_rebuild, get_page_cache_key, get_video_cache_key
+from video_app.api.progress import ConversionProgressReporter, delete_progress_state, publish_progress
+from video_app.api.storage import delete_storage_directory, storage_output
+
+
+async def read_streaming_content(response):
+    return b"".join([chunk async for chunk in response.streaming_content])
 
 
 class VideoAppIntegrationTests(APITestCase):
@@ -20,7 +41,7 @@ class VideoAppIntegrationTests(APITestCase):
             email="video@test.de",
             is_active=True,
         )
-        self.token = Token.objects.create(user=self.user)
+        self.token = AuthToken.objects.create(user=self.user)
 
         # Sample video file (dummy, not playable but valid for upload)
         self.video_file = SimpleUploadedFile(
@@ -87,10 +108,10 @@ class VideoAppIntegrationTests(APITestCase):
         self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
-        self.assertTrue(isinstance(response.data, list))
-        self.assertGreaterEqual(len(response.data), 1)
+        self.assertTrue(isinstance(response.data["results"], list))
+        self.assertGreaterEqual(len(response.data["results"]), 1)
         # Should be in descending order by uploaded_at
-        uploaded_at_list = [v["uploaded_at"] for v in response.data]
+        uploaded_at_list = [v["uploaded_at"] for v in response.data["results"]]
         self.assertEqual(uploaded_at_list, sorted(uploaded_at_list, reverse=True))
 
     def test_list_videos_no_auth(self):
@@ -219,27 +240,42 @@ class VideoAppIntegrationTests(APITestCase):
 
     def test_list_videos_empty(self):
         Video.objects.all().delete()
-        cache.delete("all_videos")
         url = "/api/videos/"
         self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data, [])
+        self.assertEqual(response.data["results"], [])
+        self.assertIsNone(response.data["next"])
 
     def test_video_list_cache(self):
         self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
         url = "/api/videos/"
 
-        cache.delete("all_videos")
+        cache.delete(get_page_cache_key({}, None, 20))
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
 
-        cache.set("all_videos", [{"title": "From Cache"}], timeout=300)
+        cache.set(get_video_cache_key(self.other_video.pk), {"title": "From Cache"}, timeout=300)
         response = self.client.get(url)
-        self.assertEqual(response.data[0]["title"], "From Cache")
+        self.assertEqual(response.data["results"][0]["title"], "From Cache")
 
-    @patch("video_app.api.tasks.subprocess.run")
+    def test_video_cache_invalidated_on_change(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        url = f"/api/videos/{self.other_video.pk}/"
+        self.assertEqual(self.client.get(url).data["description"], "Another test video.")
+        list_key = get_page_cache_key({}, None, 20)
+        self.client.get("/api/videos/")
+        self.assertIsNotNone(cache.get(list_key))
+
+        self.client.patch(url, {"description": "Changed"})
+        self.assertIsNone(cache.get(get_video_cache_key(self.other_video.pk)))
+        self.assertNotEqual(get_page_cache_key({}, None, 20), list_key)
+        self.assertEqual(self.client.get(url).data["description"], "Changed")
+        self.assertEqual(self.client.get("/api/videos/").data["results"][0]["description"], "Changed")
+
+    @patch("video_app.api.tasks.subprocess.Popen")
     def test_convert_video_calls_ffmpeg(self, mock_run):
+        mock_run.return_value.wait.return_value = 0
         video = Video.objects.create(
             title="Job Video",
             description="Test",
@@ -253,15 +289,33 @@ class VideoAppIntegrationTests(APITestCase):
     @patch("django_rq.get_queue")
     def test_signal_enqueue_tasks(self, mock_get_queue):
         mock_queue = mock_get_queue.return_value
-        video = Video.objects.create(
-            title="Signal Test",
-            description="Signal Desc",
-            genre="Action",
-            category="Movie",
-            video_file=self.video_file,
-        )
+        with self.captureOnCommitCallbacks() as callbacks:
+            video = Video.objects.create(
+                title="Signal Test",
+                description="Signal Desc",
+                genre="Action",
+                category="Movie",
+                video_file=self.video_file,
+            )
+        # Jobs are only enqueued once the video is committed
+        self.assertFalse(mock_queue.enqueue.called)
+        for callback in callbacks:
+            callback()
         self.assertTrue(mock_queue.enqueue.called)
 
+    @patch("django_rq.get_queue")
+    def test_signal_routes_thumbnail_and_transcode_to_own_queues(self, mock_get_queue):
+        with self.captureOnCommitCallbacks(execute=True):
+            Video.objects.create(
+                title="Routing", description="desc", genre="Action", category="Movie",
+                video_file="videos/foo.mp4",
+            )
+        queue_names = [c.args[0] for c in mock_get_queue.call_args_list]
+        # The conversion is scheduled by a fast probe job
+        self.assertEqual(queue_names, ["thumbnails", "thumbnails"])
+        self.assertEqual(get_queue_name("mail"), "mail")
+        self.assertEqual(get_queue_name("unknown"), "default")
+
     def test_get_base_name_and_extension(self):
         self.assertEqual(
             utils.get_base_name_and_extension("video.mp4"), ("video", "mp4")
@@ -290,33 +344,45 @@ class VideoAppIntegrationTests(APITestCase):
         self.assertIn("ffmpeg", cmd)
         self.assertIn("input", cmd)
         self.assertIn("output", cmd)
+        cmd = utils.get_ffmpeg_thumbnail_command("input", "output", [("small.webp", 320)])
+        self.assertIn("[0:v]split=2[t0][t1];[t0]scale=1920:-2[o0];[t1]scale=320:-2[o1]", cmd)
+        self.assertEqual(cmd[-3:], ["-quality", "80", "small.webp"])
 
     def test_get_ffmpeg_convert_command(self):
         cmd = utils.get_ffmpeg_convert_command("input", "output", 720)
         self.assertIn("-vf", cmd)
         self.assertIn("scale=-2:720", cmd)
 
-    @patch("django.db.models.fields.files.FieldFile.save", return_value=None)
-    @patch("video_app.api.tasks.default_storage.delete", return_value=True)
-    @patch("video_app.api.tasks.default_storage.exists", return_value=True)
-    @patch("video_app.api.tasks.ContentFile", return_value=b"img")
-    @patch("video_app.api.tasks.open", new_callable=mock_open, read_data=b"img")
-    @patch("video_app.api.tasks.subprocess.run", return_value=True)
-    @patch("video_app.api.tasks.get_ffmpeg_thumbnail_command", return_value=["ffmpeg", "args"])
-    @patch("video_app.api.tasks.build_output_filename", return_value="foo_thumbnail.jpg")
-    @patch("video_app.api.tasks.get_base_name_and_extension", return_value=("foo", "mp4"))
-    @patch("video_app.api.tasks.default_storage.path", side_effect=lambda x: x)
-    def test_create_thumbnail_success(self, mock_path, mock_get_base, mock_build_out, mock_get_cmd,
-        mock_subprocess, mock_openfile, mock_contentfile, mock_exists, mock_delete, mock_save):
+    @patch("video_app.api.tasks.subprocess.run")
+    def test_create_thumbnail_success(self, mock_run):
+        def fake_ffmpeg(command, **kwargs):
+            for path in [arg for arg in command if ".partial." in arg]:
+                with open(path, "wb") as f:
+                    f.write(b"img")
+
+        mock_run.side_effect = fake_ffmpeg
         video = Video.objects.create(
             title="Video 1", description="desc", genre="Action", category="Movie", video_file="videos/foo.mp4"
         )
-        tasks.create_thumbnail(video.id)
+        with tempfile.TemporaryDirectory() as storage_dir, patch(
+            "video_app.api.storage.default_storage.path", side_effect=lambda x: os.path.join(storage_dir, x)
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                tasks.create_thumbnail(video.id)
+            self.assertEqual(sorted(os.listdir(os.path.join(storage_dir, "thumbnails"))), [
+                "foo_thumbnail.jpg",
+                "foo_thumbnail_large.jpg", "foo_thumbnail_large.webp",
+                "foo_thumbnail_medium.jpg", "foo_thumbnail_medium.webp",
+                "foo_thumbnail_small.jpg", "foo_thumbnail_small.webp",
+            ])
+        # One ffmpeg run and one UPDATE besides loading the video
+        self.assertEqual(mock_run.call_count, 1)
+        self.assertEqual(len([q for q in queries if q["sql"].startswith("UPDATE")]), 1)
         video.refresh_from_db()
-        self.assertIn(video.status, ["processing", "ready", "failed"])
+        self.assertEqual(video.thumbnail.name, "thumbnails/foo_thumbnail.jpg")
+        self.assertEqual(video.thumbnail_variants["small"]["webp"], "thumbnails/foo_thumbnail_small.webp")
 
-
-    @patch("video_app.api.tasks.default_storage.path", side_effect=lambda x: x)
+    @patch("video_app.api.tasks.default_storage.path", side_effect=lambda x: os.path.join(tempfile.gettempdir(), x))
     def test_create_thumbnail_invalid_file(self, mock_path):
         video = Video.objects.create(
             title="NoFile", description="desc", genre="Action", category="Movie"
@@ -344,12 +410,12 @@ class VideoAppIntegrationTests(APITestCase):
         "video_app.api.tasks.get_base_name_and_extension", return_value=("foo", "mp4")
     )
     @patch("video_app.api.tasks.is_valid_video_extension", return_value=True)
-    @patch("video_app.api.tasks.default_storage.path", side_effect=lambda x: x)
+    @patch("video_app.api.tasks.default_storage.path", side_effect=lambda x: os.path.join(tempfile.gettempdir(), x))
     @patch(
         "video_app.api.tasks.get_ffmpeg_convert_command",
         return_value=["ffmpeg", "args"],
     )
-    @patch("video_app.api.tasks.subprocess.run", side_effect=Exception("fail"))
+    @patch("video_app.api.tasks.subprocess.Popen", side_effect=Exception("fail"))
     def test_convert_video_exception(
         self, mock_run, mock_get_cmd, mock_path, mock_valid, mock_get_base
     ):
@@ -366,13 +432,14 @@ class VideoAppIntegrationTests(APITestCase):
 
     @patch("django_rq.get_queue")
     def test_video_post_save_signal_enqueues_tasks(self, mock_get_queue):
-        video = Video.objects.create(
-            title="SignalTest",
-            description="desc",
-            genre="Action",
-            category="Movie",
-            video_file="videos/foo.mp4",
-        )
+        with self.captureOnCommitCallbacks(execute=True):
+            video = Video.objects.create(
+                title="SignalTest",
+                description="desc",
+                genre="Action",
+                category="Movie",
+                video_file="videos/foo.mp4",
+            )
         self.assertTrue(mock_get_queue.return_value.enqueue.called)
 
     @patch("video_app.api.signals.default_storage.exists", return_value=True)
@@ -388,3 +455,905 @@ class VideoAppIntegrationTests(APITestCase):
         video.delete()
         # Test besteht, wenn kein Fehler kommt und delete aufgerufen wird
         self.assertTrue(mock_delete.called)
+
+    def test_get_rendition_chains_is_bounded(self):
+        chains = tasks.get_rendition_chains(tasks.RESOLUTIONS, 2)
+        self.assertEqual(len(chains), 2)
+        self.assertEqual(sum(len(chain) for chain in chains), len(tasks.RESOLUTIONS))
+        self.assertEqual(len(tasks.get_rendition_chains(tasks.RESOLUTIONS, 10)), 4)
+        self.assertEqual(len(tasks.get_rendition_chains(tasks.RESOLUTIONS, 0)), 1)
+
+    @patch("django_rq.get_queue")
+    def test_fan_out_convert_video_enqueues_rungs_and_join(self, mock_get_queue):
+        video = Video.objects.create(
+            title="FanOut", description="desc", genre="Action", category="Movie",
+            video_file="videos/foo.mp4",
+        )
+        mock_queue = mock_get_queue.return_value
+        mock_queue.reset_mock()
+        with self.settings(VIDEO_MAX_PARALLEL_RENDITIONS=2):
+            tasks.fan_out_convert_video(video.id)
+        funcs = [c.args[0] for c in mock_queue.enqueue.call_args_list]
+        self.assertEqual(funcs.count(tasks.convert_video_resolution), 4)
+        self.assertEqual(funcs[-1], tasks.finalize_video_conversion)
+        self.assertEqual(len(mock_queue.enqueue.call_args_list[-1].kwargs["depends_on"]), 2)
+
+    @patch("video_app.api.tasks.default_storage.path", side_effect=lambda x: os.path.join(tempfile.gettempdir(), x))
+    @patch("video_app.api.tasks.subprocess.Popen")
+    def test_fan_out_progress_out_of_order_and_join(self, mock_popen, mock_path):
+        mock_popen.return_value.wait.return_value = 0
+        video = Video.objects.create(
+            title="Rungs", description="desc", genre="Action", category="Movie",
+            video_file="videos/foo.mp4",
+        )
+        tasks.convert_video_resolution(video.id, "1080p", 1080)
+        video.refresh_from_db()
+        self.assertEqual(video.conversion_progress, 25)
+        tasks.convert_video_resolution(video.id, "120p", 120)
+        video.refresh_from_db()
+        self.assertEqual(video.conversion_progress, 50)
+
+        tasks.finalize_video_conversion(video.id)
+        video.refresh_from_db()
+        self.assertEqual(video.status, "failed")
+
+        video.status = "processing"
+        video.save()
+        tasks.convert_video_resolution(video.id, "360p", 360)
+        tasks.convert_video_resolution(video.id, "720p", 720)
+        tasks.finalize_video_conversion(video.id)
+        video.refresh_from_db()
+        self.assertEqual(video.status, "ready")
+        self.assertEqual(video.conversion_progress, 100)
+
+    def test_get_ffmpeg_multi_convert_command(self):
+        cmd = utils.get_ffmpeg_multi_convert_command(
+            "input", [("out_120p.mp4", 120), ("out_720p.mp4", 720)]
+        )
+        self.assertEqual(cmd.count("-i"), 1)
+        graph = cmd[cmd.index("-filter_complex") + 1]
+        self.assertIn("split=2[v0][v1]", graph)
+        self.assertIn("[v1]scale=-2:720[out1]", graph)
+        self.assertIn("out_120p.mp4", cmd)
+        self.assertIn("out_720p.mp4", cmd)
+
+    @patch("video_app.api.tasks.default_storage.path", side_effect=lambda x: os.path.join(tempfile.gettempdir(), x))
+    @patch("video_app.api.tasks.subprocess.Popen")
+    def test_convert_video_single_pass_success(self, mock_run, mock_path):
+        mock_run.return_value.wait.return_value = 0
+        video = Video.objects.create(
+            title="SinglePass", description="desc", genre="Action", category="Movie",
+            video_file="videos/foo.mp4",
+        )
+        with patch("video_app.api.tasks.is_complete_output", return_value=True):
+            results = tasks.convert_video_single_pass(video.id)
+        ffmpeg_calls = [c for c in mock_run.call_args_list if c.args[0][0] == "ffmpeg"]
+        self.assertEqual(len(ffmpeg_calls), 1)
+        self.assertTrue(all(results.values()))
+        self.assertEqual(video.resolutions.count(), len(tasks.RESOLUTIONS))
+        video.refresh_from_db()
+        self.assertEqual(video.conversion_progress, 100)
+
+    @patch("video_app.api.tasks.default_storage.path", side_effect=lambda x: os.path.join(tempfile.gettempdir(), x))
+    @patch("video_app.api.tasks.subprocess.Popen")
+    def test_convert_video_single_pass_partial_failure(self, mock_run, mock_path):
+        mock_run.return_value.wait.return_value = 0
+        video = Video.objects.create(
+            title="SinglePassFail", description="desc", genre="Action", category="Movie",
+            video_file="videos/foo.mp4",
+        )
+        with patch(
+            "video_app.api.tasks.is_complete_output",
+            side_effect=lambda path: "_1080p." not in path,
+        ):
+            results = tasks.convert_video_single_pass(video.id)
+        self.assertFalse(results["1080p"])
+        self.assertTrue(results["120p"])
+        self.assertEqual(video.resolutions.count(), 0)
+        video.refresh_from_db()
+        self.assertEqual(video.status, "failed")
+
+    def test_parse_hls_segments_and_master_playlist(self):
+        playlist = "#EXTM3U\n#EXTINF:6.000000,\nsegment_0000.ts\n#EXTINF:2.5,\nsegment_0001.ts\n#EXT-X-ENDLIST\n"
+        self.assertEqual(
+            utils.parse_hls_segments(playlist),
+            [(6.0, "segment_0000.ts"), (2.5, "segment_0001.ts")],
+        )
+        master = utils.build_hls_master_playlist([("720p/index.m3u8", "720p", 2000000)])
+        self.assertTrue(master.startswith("#EXTM3U"))
+        self.assertIn("BANDWIDTH=2000000", master)
+        self.assertIn("720p/index.m3u8", master)
+
+    def test_package_video_hls_writes_master_playlist(self):
+        def fake_ffmpeg(command, check):
+            playlist_path = command[-1]
+            segment_path = os.path.join(os.path.dirname(playlist_path), "segment_0000.ts")
+            with open(segment_path, "wb") as f:
+                f.write(b"x" * 1000)
+            with open(playlist_path, "w") as f:
+                f.write("#EXTM3U\n#EXTINF:2.0,\nsegment_0000.ts\n#EXT-X-ENDLIST\n")
+
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            video = Video.objects.create(
+                title="Hls", description="desc", genre="Action", category="Movie",
+                video_file="videos/foo.mp4",
+            )
+            VideoResolution.objects.create(
+                original_video=video, resolution="360p", converted_file="videos/foo_360p.mp4"
+            )
+            with patch("video_app.api.tasks.subprocess.run", side_effect=fake_ffmpeg):
+                tasks.package_video_hls(video.id)
+            video.refresh_from_db()
+            self.assertEqual(video.hls_playlist.name, f"hls/{video.id}/master.m3u8")
+            with open(os.path.join(media_root, video.hls_playlist.name)) as f:
+                master = f.read()
+            self.assertIn("BANDWIDTH=4000", master)
+            self.assertIn("360p/index.m3u8", master)
+
+            hls_directory = os.path.join(media_root, "hls", str(video.id))
+            self.assertTrue(os.path.exists(hls_directory))
+            video.delete()
+            self.assertFalse(os.path.exists(hls_directory))
+
+    def test_parse_range_header(self):
+        self.assertEqual(utils.parse_range_header("bytes=0-99", 1000), (0, 99))
+        self.assertEqual(utils.parse_range_header("bytes=-100", 1000), (900, 999))
+        self.assertEqual(utils.parse_range_header("bytes=500-", 1000), (500, 999))
+        self.assertIsNone(utils.parse_range_header("bytes=0-1,5-6", 1000))
+        self.assertIsNone(utils.parse_range_header(None, 1000))
+        with self.assertRaises(ValueError):
+            utils.parse_range_header("bytes=1000-", 1000)
+
+    def test_stream_resolution_range_and_conditional(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            os.makedirs(os.path.join(media_root, "videos"))
+            with open(os.path.join(media_root, "videos", "foo_360p.mp4"), "wb") as f:
+                f.write(b"0123456789")
+            res = VideoResolution.objects.create(
+                original_video=self.other_video, resolution="360p", converted_file="videos/foo_360p.mp4"
+            )
+            url = f"/api/resolutions/{res.pk}/stream/"
+            self.assertEqual(self.client.get(url).status_code, 401)
+
+            self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response.streaming_content), b"0123456789")
+            self.assertEqual(response["Accept-Ranges"], "bytes")
+
+            response = self.client.get(url, HTTP_RANGE="bytes=2-5")
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b"".join(response.streaming_content), b"2345")
+            self.assertEqual(response["Content-Range"], "bytes 2-5/10")
+
+            response = self.client.get(url, HTTP_RANGE="bytes=20-")
+            self.assertEqual(response.status_code, 416)
+
+            etag = response["ETag"]
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+            with self.settings(VIDEO_STREAM_SENDFILE="x-accel-redirect"):
+                response = self.client.get(url)
+            self.assertEqual(response["X-Accel-Redirect"], "/protected-media/videos/foo_360p.mp4")
+
+            with open(os.path.join(media_root, "videos", "mein film #1_360p.mp4"), "wb") as f:
+                f.write(b"0123456789")
+            res.converted_file = "videos/mein film #1_360p.mp4"
+            res.save()
+            with self.settings(VIDEO_STREAM_SENDFILE="x-accel-redirect"):
+                response = self.client.get(url)
+            self.assertEqual(response["X-Accel-Redirect"], "/protected-media/videos/mein%20film%20%231_360p.mp4")
+
+
+    def test_list_videos_cursor_pagination_and_filters(self):
+        for index in range(4):
+            Video.objects.create(
+                title=f"Page {index}", description="desc", genre="Comedy", category="Movie",
+                video_file="videos/foo.mp4",
+            )
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+        response = self.client.get("/api/videos/", {"genre": "Comedy", "page_size": 3})
+        self.assertEqual(response.status_code, 200)
+        first_page = [v["title"] for v in response.data["results"]]
+        self.assertEqual(first_page, ["Page 3", "Page 2", "Page 1"])
+        self.assertIsNotNone(response.data["next"])
+
+        response = self.client.get(response.data["next"])
+        self.assertEqual([v["title"] for v in response.data["results"]], ["Page 0"])
+        self.assertIsNone(response.data["next"])
+
+        response = self.client.get("/api/videos/", {"genre": "Action"})
+        self.assertEqual([v["title"] for v in response.data["results"]], ["Second Video"])
+
+        response = self.client.get("/api/videos/", {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+    def _create_videos_with_resolutions(self, count):
+        for index in range(count):
+            video = Video.objects.create(
+                title=f"Query {index}", description="desc", genre="Action", category="Movie",
+                video_file="videos/foo.mp4",
+            )
+            for res_label, _ in tasks.RESOLUTIONS:
+                VideoResolution.objects.create(
+                    original_video=video, resolution=res_label, converted_file=f"videos/foo_{res_label}.mp4"
+                )
+
+    def _count_queries(self, url):
+        cache.delete_pattern("videos:*")
+        cache.delete_pattern("auth:*")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_video_list_page_uses_keyset_index(self):
+        cursor_value = encode_cursor(self.other_video.uploaded_at, self.other_video.pk + 1)
+        with CaptureQueriesContext(connection) as queries:
+            paginate_videos(Video.objects.only("id", "uploaded_at"), cursor_value, 20)
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # A few rows make Postgres prefer a sort, the test only asks if the index fits
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            explain = "EXPLAIN QUERY PLAN " if connection.vendor == "sqlite" else "EXPLAIN "
+            cursor.execute(explain + queries[0]["sql"])
+            plan = " ".join(str(column) for row in cursor.fetchall() for column in row)
+        self.assertIn("video_uploaded_at_id_idx", plan)
+
+    def test_video_list_query_budget(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        self._create_videos_with_resolutions(2)
+        few_rows = self._count_queries("/api/videos/")
+        self._create_videos_with_resolutions(10)
+        many_rows = self._count_queries("/api/videos/")
+        self.assertEqual(few_rows, many_rows)
+        # token auth + page ids + videos + prefetched resolutions
+        self.assertLessEqual(many_rows, 4)
+
+    def test_video_detail_query_budget(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        self._create_videos_with_resolutions(1)
+        video = Video.objects.get(title="Query 0")
+        self.assertLessEqual(self._count_queries(f"/api/videos/{video.pk}/"), 3)
+
+    def test_get_or_rebuild_single_flight_and_stale(self):
+        key = "videos:test:stampede"
+        cache.delete(key)
+        rebuild = MagicMock(return_value="fresh")
+        self.assertEqual(get_or_rebuild(key, rebuild), "fresh")
+        self.assertEqual(get_or_rebuild(key, rebuild), "fresh")
+        self.assertEqual(rebuild.call_count, 1)
+
+        # expired entry while another request holds the rebuild lock => stale value
+        cache.set(key, ("stale", 0.1, 0), timeout=60)
+        cache.add(f"{key}:lock", 1, timeout=10)
+        self.assertEqual(get_or_rebuild(key, rebuild), "stale")
+        self.assertEqual(rebuild.call_count, 1)
+        cache.delete(f"{key}:lock")
+        self.assertEqual(get_or_rebuild(key, rebuild), "fresh")
+        self.assertEqual(rebuild.call_count, 2)
+
+    @patch("video_app.api.cache.random.random", return_value=0.9999)
+    def test_get_or_rebuild_refreshes_early(self, mock_random):
+        key = "videos:test:early"
+        # still valid for 1s, but a 10s rebuild makes an early refresh likely
+        cache.set(key, ("old", 10.0, time.time() + 1), timeout=60)
+        self.assertEqual(get_or_rebuild(key, lambda: "new"), "new")
+        cache.delete(key)
+
+    @patch("video_app.api.progress.django_rq.get_connection")
+    def test_progress_is_published(self, mock_get_connection):
+        video = Video.objects.create(
+            title="Publish", description="desc", genre="Action", category="Movie",
+            video_file="videos/foo.mp4",
+        )
+        tasks.update_video_progress(video, 1, 4, "120p")
+        tasks.set_video_failed(video)
+        publish = mock_get_connection.return_value.pipeline.return_value.publish
+        self.assertEqual(publish.call_count, 2)
+        channel, message = publish.call_args_list[0].args
+        self.assertEqual(channel, f"video_progress:{video.id}")
+        self.assertEqual(
+            json.loads(message),
+            {"video_id": video.id, "status": "ready", "progress": 25, "current_resolution": "120p"},
+        )
+        self.assertEqual(json.loads(publish.call_args_list[1].args[1])["status"], "failed")
+
+    def test_conversion_progress_stream(self):
+        url = f"/api/conversion-progress/{self.other_video.pk}/stream/"
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.assertEqual(self.client.get(url, {"token": "invalid"}).status_code, 401)
+        # The real auth token isn't accepted in the URL, it would end up in access logs
+        self.assertEqual(self.client.get(url, {"token": self.token.key}).status_code, 401)
+
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        self.assertEqual(self.client.get("/api/conversion-progress/99999/stream/").status_code, 404)
+        self.assertEqual(self.client.post("/api/conversion-progress/99999/stream-token/").status_code, 404)
+        response = self.client.post(f"/api/conversion-progress/{self.other_video.pk}/stream-token/")
+        self.assertEqual(response.status_code, 201)
+        token, stream_url = response.data["token"], response.data["stream_url"]
+        self.client.credentials()
+        with self.settings(VIDEO_STREAM_TOKEN_MAX_AGE=-1):
+            self.assertEqual(self.client.get(stream_url).status_code, 401)
+        other_url = f"/api/conversion-progress/{self.other_video.pk + 1}/stream/"
+        self.assertEqual(self.client.get(other_url, {"token": token}).status_code, 401)
+
+        self.other_video.status = "failed"
+        self.other_video.save()
+        response = self.client.get(stream_url)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = async_to_sync(read_streaming_content)(response).decode()
+        self.assertTrue(body.startswith("event: progress\ndata: "))
+        self.assertIn('"status": "failed"', body)
+
+    def test_parse_ffmpeg_progress_seconds(self):
+        self.assertEqual(utils.parse_ffmpeg_progress_seconds("out_time_us=1500000\n"), 1.5)
+        self.assertEqual(utils.parse_ffmpeg_progress_seconds("out_time_ms=2000000"), 2.0)
+        self.assertIsNone(utils.parse_ffmpeg_progress_seconds("out_time_us=N/A"))
+        self.assertIsNone(utils.parse_ffmpeg_progress_seconds("progress=continue"))
+        cmd = utils.add_ffmpeg_progress_output(["ffmpeg", "-i", "input", "output"])
+        self.assertEqual(cmd[:4], ["ffmpeg", "-progress", "pipe:1", "-nostats"])
+
+    @patch("video_app.api.tasks.subprocess.Popen")
+    def test_run_ffmpeg_with_progress_reports_fraction(self, mock_popen):
+        mock_popen.return_value.stdout = iter(
+            ["frame=1\n", "out_time_us=5000000\n", "out_time_us=10000000\n", "progress=end\n"]
+        )
+        mock_popen.return_value.wait.return_value = 0
+        on_progress = MagicMock()
+        self.assertEqual(tasks.run_ffmpeg_with_progress(["ffmpeg"], 10.0, on_progress), 0)
+        self.assertEqual([c.args[0] for c in on_progress.call_args_list], [0.5, 1.0])
+
+        mock_popen.return_value.stdout = iter([])
+        mock_popen.return_value.wait.return_value = 1
+        with self.assertRaises(tasks.subprocess.CalledProcessError):
+            tasks.run_ffmpeg_with_progress(["ffmpeg"], 10.0, on_progress)
+
+    @patch("video_app.api.tasks.subprocess.Popen")
+    def test_run_ffmpeg_with_progress_kills_process_on_error(self, mock_popen):
+        mock_popen.return_value.stdout = iter(["out_time_us=5000000\n"])
+        on_progress = MagicMock(side_effect=RuntimeError("progress failed"))
+        with self.assertRaises(RuntimeError):
+            tasks.run_ffmpeg_with_progress(["ffmpeg"], 10.0, on_progress)
+        mock_popen.return_value.kill.assert_called_once()
+        mock_popen.return_value.wait.assert_called_once()
+
+    @patch("video_app.api.progress.publish_progress")
+    def test_progress_reporter_is_throttled(self, mock_publish):
+        reporter = ConversionProgressReporter(self.other_video, 1, 4, "360p", interval=60)
+        reporter.report(0.5)
+        reporter.report(0.9)
+        self.assertEqual(mock_publish.call_count, 1)
+        self.assertEqual(mock_publish.call_args.args[0]["progress"], 37)
+
+        reporter = ConversionProgressReporter(self.other_video, 3, 4, "1080p", interval=0)
+        reporter.report(1.0)
+        self.assertEqual(mock_publish.call_args.args[0]["progress"], 99)
+
+    def test_conversion_progress_reads_live_state(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        url = f"/api/conversion-progress/{self.other_video.pk}/"
+        publish_progress(
+            {"video_id": self.other_video.pk, "status": "processing", "progress": 42, "current_resolution": "720p"}
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.data, {"progress": 42, "current_resolution": "720p"})
+        self.other_video.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_progress_updates_only_changed_columns(self):
+        video = self.other_video
+        post_save_handler = MagicMock()
+        post_save.connect(post_save_handler, sender=Video, weak=False)
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                tasks.update_video_progress(video, 2, 4, "360p")
+        finally:
+            post_save.disconnect(post_save_handler, sender=Video)
+        updates = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"title"', updates[0])
+        self.assertFalse(post_save_handler.called)
+        video.refresh_from_db()
+        self.assertEqual((video.conversion_progress, video.status), (50, "ready"))
+
+        # an older rung finishing later must not lower the progress
+        self.assertFalse(video.update_progress(25, "120p"))
+        video.refresh_from_db()
+        self.assertEqual(video.conversion_progress, 50)
+
+        tasks.set_video_failed(video)
+        self.assertFalse(video.update_progress(75, "720p"))
+        video.refresh_from_db()
+        self.assertEqual((video.conversion_progress, video.status), (0, "failed"))
+
+    def test_parse_ffprobe_output_and_plan_resolutions(self):
+        output = json.dumps({
+            "streams": [{"codec_name": "h264", "width": 1280, "height": 720}],
+            "format": {"duration": "12.5", "bit_rate": "2500000"},
+        })
+        self.assertEqual(
+            utils.parse_ffprobe_output(output),
+            {"duration": 12.5, "width": 1280, "height": 720, "video_codec": "h264", "bitrate": 2500000},
+        )
+        self.assertEqual(
+            utils.plan_resolutions(tasks.RESOLUTIONS, 720, "h264"),
+            [("120p", 120, False), ("360p", 360, False), ("720p", 720, True)],
+        )
+        self.assertEqual(
+            utils.plan_resolutions(tasks.RESOLUTIONS, 480, "hevc"),
+            [("120p", 120, False), ("360p", 360, False)],
+        )
+        self.assertEqual(utils.plan_resolutions(tasks.RESOLUTIONS, 90, "h264"), [("120p", 120, False)])
+        self.assertEqual(len(utils.plan_resolutions(tasks.RESOLUTIONS, None, None)), 4)
+
+        cmd = utils.get_ffmpeg_multi_convert_command("input", [("a.mp4", 120), ("b.mp4", None)])
+        self.assertIn("[0:v]split=1[v0];[v0]scale=-2:120[out0]", cmd)
+        self.assertEqual(cmd[-7:], ["-map", "0:v", "-map", "0:a?", "-c", "copy", "b.mp4"])
+
+    @patch("video_app.api.tasks.default_storage.path", side_effect=lambda x: os.path.join(tempfile.gettempdir(), x))
+    @patch("video_app.api.tasks.subprocess.Popen")
+    @patch("video_app.api.tasks.subprocess.run")
+    def test_convert_video_skips_upscaling_and_copies_matching_rung(self, mock_run, mock_popen, mock_path):
+        mock_run.return_value.stdout = json.dumps({
+            "streams": [{"codec_name": "h264", "width": 1280, "height": 720}],
+            "format": {"duration": "30.0"},
+        })
+        mock_popen.return_value.wait.return_value = 0
+        video = Video.objects.create(
+            title="Probe", description="desc", genre="Action", category="Movie",
+            video_file="videos/foo.mp4",
+        )
+        with patch("video_app.api.tasks.enqueue_packaging"):
+            convert_video(video.id)
+        video.refresh_from_db()
+        self.assertEqual((video.height, video.duration), (720, 30.0))
+        self.assertEqual(
+            sorted(video.resolutions.values_list("resolution", flat=True)), ["120p", "360p", "720p"]
+        )
+        self.assertEqual(video.conversion_progress, 100)
+        commands = [c.args[0] for c in mock_popen.call_args_list]
+        self.assertEqual(len(commands), 3)
+        self.assertIn("copy", commands[-1])
+        self.assertNotIn("libx264", commands[-1])
+
+    @patch("django_rq.get_queue")
+    def test_upload_same_file_twice_reuses_original(self, mock_get_queue):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        responses = []
+        for title in ["First Upload", "Second Upload"]:
+            data = {
+                "title": title, "description": "desc", "genre": "Comedy", "category": "Movie",
+                "video_file": SimpleUploadedFile("same.mp4", b"same content", content_type="video/mp4"),
+            }
+            with self.captureOnCommitCallbacks(execute=True):
+                responses.append(self.client.post("/api/upload/", data, format="multipart"))
+        self.assertEqual([r.status_code for r in responses], [201, 201])
+        first = Video.objects.get(title="First Upload")
+        second = Video.objects.get(title="Second Upload")
+        self.assertEqual(len(first.content_hash), 64)
+        self.assertEqual(second.duplicate_of, first)
+        self.assertIsNone(second.content_hash)
+        self.assertEqual(second.video_file.name, first.video_file.name)
+        self.assertEqual(responses[1].data["video_file"], responses[0].data["video_file"])
+        # Only the first upload is converted
+        self.assertEqual(mock_get_queue.return_value.enqueue.call_count, 2)
+
+    @patch("django_rq.get_queue")
+    def test_upload_after_failed_original_is_converted_again(self, mock_get_queue):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        for title in ["Failed Upload", "Retry Upload"]:
+            data = {
+                "title": title, "description": "desc", "genre": "Comedy", "category": "Movie",
+                "video_file": SimpleUploadedFile("broken.mp4", b"broken content", content_type="video/mp4"),
+            }
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post("/api/upload/", data, format="multipart")
+            self.assertEqual(response.status_code, 201)
+            if title == "Failed Upload":
+                failed = Video.objects.get(title=title)
+                failed.mark_failed()
+        failed.refresh_from_db()
+        retry = Video.objects.get(title="Retry Upload")
+        self.assertIsNone(retry.duplicate_of)
+        self.assertEqual(retry.status, "processing")
+        self.assertEqual(len(retry.content_hash), 64)
+        self.assertIsNone(failed.content_hash)
+        self.assertNotEqual(retry.video_file.name, failed.video_file.name)
+        # Both uploads were sent to thumbnail and conversion
+        self.assertEqual(mock_get_queue.return_value.enqueue.call_count, 4)
+
+    @patch("django_rq.get_queue")
+    def test_duplicate_progress_follows_original_until_finished(self, mock_get_queue):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        for title in ["Original", "Duplicate"]:
+            self.client.post("/api/upload/", {
+                "title": title, "description": "desc", "genre": "Comedy", "category": "Movie",
+                "video_file": SimpleUploadedFile("dup.mp4", b"duplicate content", content_type="video/mp4"),
+            }, format="multipart")
+        original = Video.objects.get(title="Original")
+        duplicate = Video.objects.get(title="Duplicate", duplicate_of=original)
+        self.addCleanup(delete_progress_state, original.pk)
+        self.assertEqual((duplicate.status, duplicate.conversion_progress), ("processing", 0))
+
+        # Poll the duplicate while the original is converted
+        url = f"/api/conversion-progress/{duplicate.pk}/"
+        polled = []
+        for done in range(1, 5):
+            tasks.update_video_progress(original, done, 4, f"res{done}")
+            polled.append(self.client.get(url).data["progress"])
+        self.assertEqual(polled, [25, 50, 75, 100])
+
+        duplicate.refresh_from_db()
+        self.assertEqual((duplicate.status, duplicate.conversion_progress), ("ready", 100))
+        ready_ids = [v["id"] for v in self.client.get("/api/videos/", {"status": "ready"}).data["results"]]
+        processing_ids = [v["id"] for v in self.client.get("/api/videos/", {"status": "processing"}).data["results"]]
+        self.assertIn(duplicate.pk, ready_ids)
+        self.assertNotIn(duplicate.pk, processing_ids)
+
+        # The stream of the finished duplicate sends the final event and ends
+        response = self.client.get(f"{url}stream/")
+        body = async_to_sync(read_streaming_content)(response).decode()
+        self.assertIn(f'"video_id": {duplicate.pk}', body)
+        self.assertIn('"progress": 100', body)
+
+    @patch("video_app.api.signals.default_storage.delete")
+    def test_deleting_original_promotes_duplicate(self, mock_delete):
+        original = Video.objects.create(
+            title="Original", description="desc", genre="Action", category="Movie",
+            video_file="videos/foo.mp4", content_hash="a" * 64, conversion_progress=100, status="ready",
+        )
+        VideoResolution.objects.create(original_video=original, resolution="360p", converted_file="videos/foo_360p.mp4")
+        duplicate = Video.objects.create(
+            title="Duplicate", description="desc", genre="Action", category="Movie",
+            video_file="videos/foo.mp4", duplicate_of=original,
+        )
+        original.delete()
+        duplicate.refresh_from_db()
+        self.assertIsNone(duplicate.duplicate_of)
+        self.assertEqual(duplicate.content_hash, "a" * 64)
+        self.assertEqual((duplicate.conversion_progress, duplicate.status), (100, "ready"))
+        self.assertEqual(list(duplicate.resolutions.values_list("resolution", flat=True)), ["360p"])
+        mock_delete.assert_not_called()
+
+    @patch("django_rq.get_queue")
+    def test_chunked_upload_resumes_and_creates_video_at_the_end(self, mock_get_queue):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        content = b"0123456789" * 10
+        response = self.client.post("/api/uploads/", {
+            "filename": "chunked.mp4", "size": len(content), "title": "Chunked",
+            "description": "desc", "genre": "Comedy", "category": "Movie",
+        })
+        self.assertEqual(response.status_code, 201)
+        url = f"/api/uploads/{response.data['id']}/"
+
+        def put_chunk(start, end):
+            return self.client.put(
+                url, content[start:end + 1], content_type="application/offset+octet-stream",
+                HTTP_CONTENT_RANGE=f"bytes {start}-{end}/{len(content)}",
+            )
+
+        self.assertEqual(put_chunk(0, 39).data["offset"], 40)
+        # A chunk that doesn't start at the offset is refused
+        response = put_chunk(60, 99)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Upload-Offset"], "40")
+        self.assertEqual(self.client.get(url).data["offset"], 40)
+        self.assertFalse(Video.objects.filter(title="Chunked").exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = put_chunk(40, 99)
+        self.assertEqual(response.status_code, 201)
+        video = Video.objects.get(title="Chunked")
+        with video.video_file.open("rb") as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(len(video.content_hash), 64)
+        self.assertEqual(VideoUpload.objects.get(pk=url.split("/")[-2]).video, video)
+        self.assertTrue(mock_get_queue.return_value.enqueue.called)
+
+    @patch("django_rq.get_queue")
+    def test_chunked_upload_completion_can_be_retried(self, mock_get_queue):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        content = b"retry content"
+        upload = VideoUpload.objects.create(
+            user=self.user, filename="retry.mp4", size=len(content), title="Retry", description="d"
+        )
+        url = f"/api/uploads/{upload.id}/"
+
+        def put_last_chunk():
+            return self.client.put(
+                url, content, content_type="application/offset+octet-stream",
+                HTTP_CONTENT_RANGE=f"bytes 0-{len(content) - 1}/{len(content)}",
+            )
+
+        # The bytes are stored, but creating the video fails
+        self.client.raise_request_exception = False
+        with patch("video_app.api.views.save_uploaded_video", side_effect=OSError("disk full")):
+            self.assertEqual(put_last_chunk().status_code, 500)
+        upload.refresh_from_db()
+        self.assertEqual((upload.offset, upload.video), (len(content), None))
+
+        # Retrying the last chunk finishes the upload, later retries return the same video
+        response = put_last_chunk()
+        self.assertEqual(response.status_code, 201)
+        video = Video.objects.get(title="Retry")
+        with video.video_file.open("rb") as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(put_last_chunk().status_code, 200)
+        response = self.client.put(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["id"], video.pk)
+        self.assertEqual(Video.objects.filter(title="Retry").count(), 1)
+
+    def test_chunked_upload_is_received_before_the_row_is_locked(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        upload = VideoUpload.objects.create(
+            user=self.user, filename="a.mp4", size=10, title="t", description="d"
+        )
+        receive = views.receive_upload_chunk
+
+        def receive_while_another_put_finishes(*args):
+            # A concurrent PUT of the same range stores it while this body is read
+            result = receive(*args)
+            VideoUpload.objects.filter(pk=upload.pk).update(offset=5)
+            return result
+
+        with patch("video_app.api.views.receive_upload_chunk", side_effect=receive_while_another_put_finishes):
+            response = self.client.put(
+                f"/api/uploads/{upload.id}/", b"01234", content_type="application/offset+octet-stream",
+                HTTP_CONTENT_RANGE="bytes 0-4/10",
+            )
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Upload-Offset"], "5")
+        self.assertEqual(
+            [n for n in os.listdir(settings.VIDEO_UPLOAD_TEMP_DIR) if n.endswith(".chunk")], []
+        )
+
+    def test_chunked_upload_rejects_invalid_content_range(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        upload = VideoUpload.objects.create(
+            user=self.user, filename="a.mp4", size=10, title="t", description="d"
+        )
+        response = self.client.put(
+            f"/api/uploads/{upload.id}/", b"01234", content_type="application/offset+octet-stream",
+            HTTP_CONTENT_RANGE="bytes 0-9/10",
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.put(
+            f"/api/uploads/{upload.id}/", b"0123456789", content_type="application/offset+octet-stream",
+            HTTP_CONTENT_RANGE="bytes 0-9/10", CONTENT_LENGTH="ten",
+        )
+        self.assertEqual(response.status_code, 400)
+        with self.assertRaises(ValueError):
+            utils.parse_content_length("-1")
+        self.assertEqual(utils.parse_content_range_header("bytes 0-99/1000"), (0, 99, 1000))
+        with self.assertRaises(ValueError):
+            utils.parse_content_range_header("bytes 5-2/10")
+
+    @patch("django_rq.get_queue")
+    def test_direct_upload_through_presigned_url(self, mock_get_queue):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        content = b"direct content"
+        response = self.client.post("/api/uploads/direct/", {
+            "filename": "direct.mp4", "size": len(content), "title": "Direct",
+            "description": "desc", "genre": "Comedy", "category": "Movie",
+        })
+        self.assertEqual(response.status_code, 201)
+        complete_url = f"/api/uploads/{response.data['id']}/complete/"
+        self.assertEqual(self.client.post(complete_url).status_code, 409)
+
+        # The presigned URL needs no token, a GET URL can't be used for PUT
+        self.client.credentials()
+        upload_url = response.data["upload_url"]
+        self.assertEqual(
+            self.client.put(upload_url, content, content_type="application/octet-stream").status_code, 200
+        )
+        self.assertEqual(self.client.get(upload_url).status_code, 403)
+
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(complete_url)
+        self.assertEqual(response.status_code, 201)
+        video = Video.objects.get(title="Direct")
+        self.assertEqual(video.video_file.name, VideoUpload.objects.get(video=video).storage_name)
+        with video.video_file.open("rb") as f:
+            self.assertEqual(f.read(), content)
+        self.assertTrue(mock_get_queue.return_value.enqueue.called)
+
+        # The file of the created video can't be replaced through the still valid URL
+        self.client.credentials()
+        response = self.client.put(upload_url, b"replaced", content_type="application/octet-stream")
+        self.assertEqual(response.status_code, 409)
+        with video.video_file.open("rb") as f:
+            self.assertEqual(f.read(), content)
+        self.assertFalse([n for n in os.listdir(os.path.dirname(video.video_file.path)) if n.endswith(".partial")])
+
+    def test_presigned_upload_size_is_enforced_and_stale_uploads_expire(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        response = self.client.post("/api/uploads/direct/", {
+            "filename": "stale.mp4", "size": 5, "title": "Stale",
+            "description": "desc", "genre": "Comedy", "category": "Movie",
+        })
+        upload = VideoUpload.objects.get(pk=response.data["id"])
+        upload_url = response.data["upload_url"]
+        self.client.credentials()
+        response = self.client.put(upload_url, b"0123456789", content_type="application/octet-stream")
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(default_storage.exists(upload.storage_name))
+
+        # Uploaded but never completed: removed with the upload once it is stale
+        self.assertEqual(
+            self.client.put(upload_url, b"01234", content_type="application/octet-stream").status_code, 200
+        )
+        self.assertEqual(tasks.delete_stale_uploads(), 0)
+        VideoUpload.objects.filter(pk=upload.pk).update(updated_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(tasks.delete_stale_uploads(), 1)
+        self.assertFalse(VideoUpload.objects.filter(pk=upload.pk).exists())
+        self.assertFalse(default_storage.exists(upload.storage_name))
+
+    @patch("video_app.api.storage.default_storage.save")
+    @patch("video_app.api.storage.default_storage.path", side_effect=NotImplementedError)
+    def test_storage_output_uploads_to_remote_storage(self, mock_path, mock_save):
+        with storage_output("videos/foo_360p.mp4") as output_path:
+            with open(output_path, "wb") as f:
+                f.write(b"converted")
+        self.assertEqual(mock_save.call_args.args[0], "videos/foo_360p.mp4")
+        self.assertFalse(os.path.exists(output_path))
+
+        with self.assertRaises(RuntimeError):
+            with storage_output("videos/foo_720p.mp4") as output_path:
+                raise RuntimeError("ffmpeg failed")
+        self.assertEqual(mock_save.call_count, 1)
+
+    @patch("video_app.api.storage.default_storage")
+    def test_delete_storage_directory_on_remote_storage(self, mock_storage):
+        # Like S3, a prefix doesn't "exist" but lists its objects
+        mock_storage.exists.return_value = False
+        listing = {"hls/7": (["360p"], ["master.m3u8"]), "hls/7/360p": ([], ["index.m3u8", "seg0.ts"])}
+        mock_storage.listdir.side_effect = lambda directory: listing[directory]
+        delete_storage_directory("hls/7")
+        self.assertEqual(
+            [c.args[0] for c in mock_storage.delete.call_args_list],
+            ["hls/7/360p/index.m3u8", "hls/7/360p/seg0.ts", "hls/7/360p", "hls/7/master.m3u8", "hls/7"],
+        )
+
+        mock_storage.listdir.side_effect = FileNotFoundError
+        delete_storage_directory("hls/missing")
+        self.assertEqual(mock_storage.delete.call_count, 5)
+
+    def test_estimate_transcode_seconds(self):
+        plan = [("360p", 360, False), ("720p", 720, True), ("1080p", 1080, False)]
+        self.assertAlmostEqual(utils.estimate_transcode_seconds(540, plan), 600)
+        self.assertIsNone(utils.estimate_transcode_seconds(None, plan))
+
+    @patch("django_rq.get_queue")
+    def test_schedule_conversion_routes_by_estimated_cost(self, mock_get_queue):
+        with self.settings(
+            VIDEO_TRANSCODE_SPEED_FACTOR=1.0, VIDEO_CONVERSION_MODE="sequential", VIDEO_SEGMENTED_MIN_DURATION=None
+        ):
+            for duration, queue_name in [(30.0, "transcode_short"), (600.0, "transcode"), (7200.0, "transcode_large")]:
+                video = Video.objects.create(
+                    title="Scheduled", description="desc", genre="Action", category="Movie",
+                    video_file="videos/foo.mp4", duration=duration, height=1080, video_codec="hevc",
+                )
+                mock_get_queue.reset_mock()
+                tasks.schedule_conversion(video.id)
+                mock_get_queue.assert_called_once_with(queue_name, autocommit=True)
+                enqueue = mock_get_queue.return_value.enqueue.call_args
+                self.assertEqual(enqueue.args[:2], (tasks.convert_video, video.id))
+                estimate = utils.estimate_transcode_seconds(duration, tasks.get_resolution_plan(video))
+                self.assertEqual(enqueue.kwargs["job_timeout"], max(360, int(estimate * 3)))
+
+    @patch("video_app.api.tasks.enqueue_packaging")
+    @patch("video_app.api.tasks.subprocess.run", side_effect=OSError("no ffprobe"))
+    @patch("video_app.api.tasks.subprocess.Popen")
+    def test_retried_conversion_skips_finished_resolutions(self, mock_popen, mock_run, mock_packaging):
+        video = Video.objects.create(
+            title="Resume", description="desc", genre="Action", category="Movie",
+            video_file="videos/foo.mp4",
+        )
+        encoded = []
+
+        def fake_ffmpeg(command, **kwargs):
+            output_path = next(arg for arg in command if ".partial." in str(arg))
+            process = MagicMock(stdout=[])
+            if "360p" in output_path and not encoded.count(output_path):
+                # The worker dies while encoding 360p
+                encoded.append(output_path)
+                process.wait.return_value = 1
+                return process
+            encoded.append(output_path)
+            with open(output_path, "wb") as f:
+                f.write(b"video")
+            process.wait.return_value = 0
+            return process
+
+        mock_popen.side_effect = fake_ffmpeg
+        with tempfile.TemporaryDirectory() as storage_dir, patch(
+            "video_app.api.storage.default_storage.path", side_effect=lambda x: os.path.join(storage_dir, x)
+        ):
+            with patch("video_app.api.tasks.get_current_job", return_value=MagicMock(retries_left=2)):
+                with self.assertRaises(subprocess.CalledProcessError):
+                    convert_video(video.id)
+            self.assertFalse(os.path.exists(os.path.join(storage_dir, "videos/foo_360p.mp4")))
+            self.assertFalse(os.path.exists(os.path.join(storage_dir, "videos/foo_360p.partial.mp4")))
+            video.refresh_from_db()
+            self.assertNotEqual(video.status, "failed")
+
+            convert_video(video.id)
+        labels = [os.path.basename(path) for path in encoded]
+        # 120p isn't encoded again and no resolution row is duplicated
+        self.assertEqual(labels.count("foo_120p.partial.mp4"), 1)
+        self.assertEqual(labels.count("foo_360p.partial.mp4"), 2)
+        self.assertEqual(
+            sorted(video.resolutions.values_list("resolution", flat=True)), ["1080p", "120p", "360p", "720p"]
+        )
+        self.assertEqual(Video.objects.get(pk=video.pk).conversion_progress, 100)
+
+    def test_segment_and_concat_commands(self):
+        self.assertEqual(utils.get_segment_seconds(3600, 8), 450)
+        self.assertEqual(utils.get_segment_seconds(300, 8), 60)
+        cmd = utils.get_ffmpeg_segment_command("in.mp4", "seg_%04d.mp4", 450)
+        self.assertEqual(cmd[cmd.index("-f") + 1], "segment")
+        self.assertEqual(cmd[cmd.index("-c") + 1], "copy")
+        self.assertEqual(utils.build_concat_list(["/a.mp4", "/it's.mp4"]), "file '/a.mp4'\nfile '/it'\\''s.mp4'\n")
+        self.assertEqual(utils.get_ffmpeg_concat_command("list.txt", "out.mp4")[-3:], ["-c", "copy", "out.mp4"])
+
+    @patch("django_rq.get_queue")
+    @patch("video_app.api.tasks.subprocess.run")
+    def test_split_video_source_enqueues_segment_jobs(self, mock_run, mock_get_queue):
+        def fake_split(command, **kwargs):
+            for index in range(3):
+                with open(command[-1] % index, "wb") as f:
+                    f.write(b"segment")
+
+        mock_run.side_effect = fake_split
+        video = Video.objects.create(
+            title="Long", description="desc", genre="Action", category="Movie",
+            video_file="videos/long.mp4", duration=3600.0, height=720, video_codec="h264",
+        )
+        mock_queue = mock_get_queue.return_value
+        mock_queue.reset_mock()
+        with tempfile.TemporaryDirectory() as storage_dir, patch(
+            "video_app.api.storage.default_storage.path", side_effect=lambda x: os.path.join(storage_dir, x)
+        ):
+            tasks.split_video_source(video.id)
+        funcs = [c.args[0] for c in mock_queue.enqueue.call_args_list]
+        # 120p and 360p in 3 segments each, 720p is copied
+        self.assertEqual(funcs.count(tasks.encode_video_segment), 6)
+        self.assertEqual(funcs.count(tasks.concat_video_segments), 2)
+        self.assertEqual(funcs.count(tasks.convert_video_resolution), 1)
+        self.assertEqual(funcs[-1], tasks.finalize_video_conversion)
+        concat_call = mock_queue.enqueue.call_args_list[funcs.index(tasks.concat_video_segments)]
+        self.assertEqual(concat_call.args[3], [f"segments/{video.id}/source/segment_{i:04d}.mp4" for i in range(3)])
+        self.assertEqual(len(concat_call.kwargs["depends_on"]), 3)
+
+    @patch("video_app.api.tasks.subprocess.Popen")
+    def test_concat_video_segments_records_resolution(self, mock_popen):
+        commands = []
+
+        def fake_concat(command, **kwargs):
+            commands.append(command)
+            with open(command[command.index("-i") + 1]) as f:
+                commands.append(f.read())
+            with open(command[-1], "wb") as f:
+                f.write(b"joined")
+            return MagicMock(stdout=[], **{"wait.return_value": 0})
+
+        mock_popen.side_effect = fake_concat
+        video = Video.objects.create(
+            title="Long", description="desc", genre="Action", category="Movie",
+            video_file="videos/long.mp4", duration=3600.0, height=360, video_codec="hevc",
+        )
+        segment_names = [f"segments/{video.id}/source/segment_{i:04d}.mp4" for i in range(2)]
+        with tempfile.TemporaryDirectory() as storage_dir, patch(
+            "video_app.api.storage.default_storage.path", side_effect=lambda x: os.path.join(storage_dir, x)
+        ):
+            tasks.concat_video_segments(video.id, "360p", segment_names)
+            self.assertTrue(os.path.exists(os.path.join(storage_dir, "videos/long_360p.mp4")))
+        self.assertIn("concat", commands[0])
+        self.assertIn(f"segments/{video.id}/360p/segment_0001.mp4'", commands[1])
+        self.assertEqual(video.resolutions.get().converted_file.name, "videos/long_360p.mp4")
+        self.assertEqual(Video.objects.get(pk=video.pk).conversion_progress, 50)